@@ -0,0 +1,92 @@
+"""Per-tenant read caches with memory budgets and LRU eviction."""
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate the memory held by a cached payload via its JSON length"""
+    return len(json.dumps(value, default=str))
+
+
+class TenantCache:
+    """LRU caches keyed by tenant, each capped at ``tenant_bytes``.
+
+    Tenants are themselves kept in LRU order, and whole tenants are evicted
+    once the combined size exceeds ``total_bytes``, so a burst of traffic to
+    cold sites cannot push out every hot one at once. Entries expire after
+    ``ttl`` seconds to bound staleness from writes made by other processes.
+    """
+
+    def __init__(self, tenant_bytes: int, total_bytes: int, ttl: float):
+        self.tenant_bytes = tenant_bytes
+        self.total_bytes = total_bytes
+        self.ttl = ttl
+        self._tenants: "OrderedDict[Optional[str], OrderedDict]" = OrderedDict()
+        self._sizes = {}
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, tenant: Optional[str], key: Hashable):
+        entries = self._tenants.get(tenant)
+        entry = entries.get(key) if entries is not None else None
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(tenant, key)
+            self.misses += 1
+            return None
+        self._tenants.move_to_end(tenant)
+        entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, tenant: Optional[str], key: Hashable, value: Any):
+        size = estimate_size(value)
+        if size > self.tenant_bytes:
+            return
+        if key in self._tenants.get(tenant, ()):
+            self._remove(tenant, key)
+        entries = self._tenants.get(tenant)
+        if entries is None:
+            entries = self._tenants[tenant] = OrderedDict()
+            self._sizes[tenant] = 0
+        entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._sizes[tenant] += size
+        self._total += size
+        self._tenants.move_to_end(tenant)
+
+        while self._sizes[tenant] > self.tenant_bytes:
+            self._remove(tenant, next(iter(entries)))
+            self.evictions += 1
+        while self._total > self.total_bytes and len(self._tenants) > 1:
+            oldest = next(iter(self._tenants))
+            self.evictions += len(self._tenants[oldest])
+            self.invalidate(oldest)
+
+    def _remove(self, tenant, key):
+        entries = self._tenants[tenant]
+        _, size, _ = entries.pop(key)
+        self._sizes[tenant] -= size
+        self._total -= size
+        if not entries:
+            del self._tenants[tenant]
+            del self._sizes[tenant]
+
+    def invalidate(self, tenant: Optional[str]):
+        """Drop every cached payload for a tenant"""
+        if tenant in self._tenants:
+            del self._tenants[tenant]
+            self._total -= self._sizes.pop(tenant)
+
+    def stats(self):
+        return {
+            "tenants": len(self._tenants),
+            "entries": sum(len(entries) for entries in self._tenants.values()),
+            "bytes": self._total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -15,6 +15,8 @@ db = client[os.environ['DB_NAME']]
 portfolio_collection = db.portfolio
 services_collection = db.services
 projects_collection = db.projects
+changes_collection = db.changes
+counters_collection = db.counters
 
 async def close_db_client():
     client.close()
@@ -0,0 +1,202 @@
+"""Server-Sent Events fan-out of change-log entries to connected clients."""
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from itertools import islice
+from typing import Dict, Optional
+
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', 10000))
+# Events kept per tenant for clients that are momentarily behind
+SSE_BUFFER_SIZE = int(os.environ.get('SSE_BUFFER_SIZE', 256))
+# Most changes replayed to a reconnecting client before it is sent a reset
+SSE_REPLAY_LIMIT = int(os.environ.get('SSE_REPLAY_LIMIT', 1000))
+
+RETRY_EVENT = b"retry: 5000\n\n"
+HEARTBEAT_EVENT = b": heartbeat\n\n"
+RESET_EVENT = b"event: reset\ndata: {}\n\n"
+
+# Fields of a change-log entry worth pushing; clients refetch for the rest
+EVENT_FIELDS = ("seq", "collection", "op", "id", "fields")
+
+
+def encode_change(entry) -> bytes:
+    """Encode a change-log entry as one SSE ``change`` event"""
+    data = {field: entry[field] for field in EVENT_FIELDS if field in entry}
+    return f"id: {entry['seq']}\nevent: change\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class _Channel:
+    """Ring buffer of encoded events for one tenant.
+
+    Publishing appends once and resolves a single shared future, so the cost
+    of an event does not depend on what each subscriber does with it; every
+    subscriber keeps only a cursor into the buffer.
+    """
+
+    def __init__(self, size: int):
+        self.buffer = deque(maxlen=size)
+        self.next_index = 0
+        self.subscribers = 0
+        self.waiter = asyncio.get_running_loop().create_future()
+
+    def wake(self):
+        waiter, self.waiter = self.waiter, asyncio.get_running_loop().create_future()
+        waiter.set_result(None)
+
+    def publish(self, seq: int, payload: bytes):
+        self.buffer.append((self.next_index, seq, payload))
+        self.next_index += 1
+        self.wake()
+
+
+class EventBroker:
+    """Tails the repository's change log and streams it to SSE subscribers"""
+
+    def __init__(self):
+        self.channels: Dict[Optional[str], _Channel] = {}
+        self.clients = 0
+        self.published = 0
+        self.resets = 0
+        self.replayed = 0
+        self.repository = None
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, repository):
+        if not repository.has_change_log:
+            return
+        self.repository = repository
+        self._tasks = [
+            asyncio.create_task(self._consume(repository)),
+            asyncio.create_task(self._heartbeat()),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _consume(self, repository):
+        while True:
+            try:
+                async for entry in repository.tail_changes():
+                    self.publish(entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error tailing change log: {str(e)}")
+            await asyncio.sleep(1)
+
+    async def _heartbeat(self):
+        # One timer for every connection instead of one per client
+        while True:
+            await asyncio.sleep(SSE_HEARTBEAT_SECONDS)
+            for channel in list(self.channels.values()):
+                channel.wake()
+
+    def publish(self, entry):
+        channel = self.channels.get(entry.get("tenant"))
+        if channel is None:
+            return
+        channel.publish(entry["seq"], encode_change(entry))
+        self.published += 1
+
+    def accepting(self) -> bool:
+        return self.running and self.clients < SSE_MAX_CLIENTS
+
+    async def _catch_up(self, tenant: Optional[str], last_event_id: Optional[str]):
+        """Return the events owed to a client reconnecting after ``last_event_id``
+        and the sequence number they bring it up to.
+
+        Missed changes are replayed from the change log. When they cannot be
+        (evicted from the log, too many, or a concurrent write still in
+        flight) the client gets a ``reset`` instead and should refetch.
+        """
+        try:
+            if last_event_id is None:
+                return b"", await self.repository.latest_change(tenant)
+            since = int(last_event_id)
+            events = []
+            while True:
+                page = await self.repository.list_changes(tenant, since, SSE_REPLAY_LIMIT - len(events) + 1)
+                if page["reset"] or page["pending"]:
+                    break
+                events.extend(encode_change(entry) for entry in page["changes"])
+                since = page["next"]
+                if len(events) > SSE_REPLAY_LIMIT:
+                    break
+                if not page["changes"]:
+                    self.replayed += len(events)
+                    return b"".join(events), since
+        except Exception as e:
+            logging.error(f"Error replaying changes after event {last_event_id!r}: {str(e)}")
+        self.resets += 1
+        try:
+            latest = await self.repository.latest_change(tenant)
+        except Exception:
+            latest = None
+        return RESET_EVENT, latest
+
+    async def stream(self, tenant: Optional[str], last_event_id: Optional[str] = None):
+        """Yield encoded events for one client until it disconnects.
+
+        A client reconnecting with ``Last-Event-ID`` first gets the changes
+        it missed. A client that reads slower than events arrive falls off
+        the end of the ring buffer; it then gets a single ``reset`` event
+        and should refetch, so a slow reader never holds more than the
+        shared buffer.
+        """
+        channel = self.channels.get(tenant)
+        if channel is None:
+            channel = self.channels[tenant] = _Channel(SSE_BUFFER_SIZE)
+        channel.subscribers += 1
+        self.clients += 1
+        # Subscribe before reading the log, so nothing falls between the two
+        cursor = channel.next_index
+        try:
+            missed, seq = await self._catch_up(tenant, last_event_id)
+            # Live events the replay already covered are skipped
+            replayed = seq if last_event_id is not None and missed is not RESET_EVENT else 0
+            # An id-only message sets the browser's Last-Event-ID for reconnects
+            position = f"id: {seq}\n\n".encode() if seq is not None else b""
+            yield RETRY_EVENT + missed + position
+            while True:
+                if cursor == channel.next_index:
+                    await asyncio.shield(channel.waiter)
+                    if cursor == channel.next_index:
+                        yield HEARTBEAT_EVENT
+                    continue
+                oldest = channel.buffer[0][0]
+                if cursor < oldest:
+                    self.resets += 1
+                    cursor = channel.next_index
+                    yield RESET_EVENT
+                    continue
+                pending = [
+                    payload for _, seq, payload in islice(channel.buffer, cursor - oldest, None)
+                    if seq > replayed
+                ]
+                cursor = channel.next_index
+                if pending:
+                    yield b"".join(pending)
+        finally:
+            channel.subscribers -= 1
+            self.clients -= 1
+            if channel.subscribers == 0 and self.channels.get(tenant) is channel:
+                del self.channels[tenant]
+
+    def stats(self):
+        return {
+            "clients": self.clients,
+            "tenants": len(self.channels),
+            "published": self.published,
+            "resets": self.resets,
+            "replayed": self.replayed,
+        }
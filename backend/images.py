@@ -0,0 +1,315 @@
+"""Precompute dimensions, dominant color and a BlurHash placeholder for every
+image a project references, so cards can reserve space and paint a preview
+before the image itself downloads.
+
+Run ``python images.py`` to process every project (``--force`` recomputes
+images whose metadata is already stored, ``--allow-local`` also reads local
+files and private hosts, for fixture images).
+"""
+import asyncio
+import io
+import ipaddress
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin, urlparse
+
+import numpy as np
+import requests
+import urllib3
+from PIL import Image
+
+# Images are reduced to this size before color and placeholder analysis
+ANALYSIS_SIZE = (64, 64)
+BLURHASH_COMPONENTS = (4, 3)
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+MAX_REDIRECTS = 3
+# Larger images are rejected before decoding (RGB decode is 3 bytes a pixel)
+MAX_IMAGE_PIXELS = 25_000_000
+# Images beyond this many per project are left without metadata
+MAX_IMAGES_PER_PROJECT = 30
+# Time allowed for one whole download, however slowly the host sends it
+IMAGE_DOWNLOAD_SECONDS = float(os.environ.get('IMAGE_DOWNLOAD_SECONDS', 20))
+# Time allowed for all of one project's images; the rest wait for the next run
+IMAGE_JOB_SECONDS = float(os.environ.get('IMAGE_JOB_SECONDS', 120))
+# Image jobs run on their own queue with this many workers
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 1))
+CONNECT_TIMEOUT = 5
+# Longest single socket read, which bounds how late a deadline is noticed
+READ_TIMEOUT = 5
+READ_CHUNK = 64 * 1024
+
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(pixels: np.ndarray) -> np.ndarray:
+    v = pixels / 255.0
+    return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(value: np.ndarray) -> np.ndarray:
+    v = np.clip(value, 0, 1)
+    srgb = np.where(v <= 0.0031308, v * 12.92, 1.055 * np.power(v, 1 / 2.4) - 0.055)
+    return (srgb * 255 + 0.5).astype(int)
+
+
+def blurhash(pixels: np.ndarray, components=BLURHASH_COMPONENTS) -> str:
+    """Encode an ``(height, width, 3)`` uint8 array as a BlurHash string.
+
+    All DCT factors are computed in one ``einsum`` over the image instead of
+    a per-pixel loop per component.
+    """
+    x_components, y_components = components
+    height, width, _ = pixels.shape
+    linear = _srgb_to_linear(pixels.astype(np.float64))
+
+    basis_x = np.cos(np.pi * np.arange(x_components)[:, None] * np.arange(width)[None, :] / width)
+    basis_y = np.cos(np.pi * np.arange(y_components)[:, None] * np.arange(height)[None, :] / height)
+    factors = np.einsum("jy,ix,yxc->jic", basis_y, basis_x, linear) / (width * height)
+    factors[1:] *= 2
+    factors[0, 1:] *= 2
+    factors = factors.reshape(-1, 3)
+    dc, ac = factors[0], factors[1:]
+
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if len(ac):
+        quantised_max = int(np.clip(np.floor(np.abs(ac).max() * 166 - 0.5), 0, 82))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    result += _base83(quantised_max, 1)
+
+    r, g, b = _linear_to_srgb(dc)
+    result += _base83((int(r) << 16) + (int(g) << 8) + int(b), 4)
+
+    scaled = ac / max_value
+    quantised = np.clip(np.floor(np.sign(scaled) * np.sqrt(np.abs(scaled)) * 9 + 9.5), 0, 18).astype(int)
+    for qr, qg, qb in quantised:
+        result += _base83(qr * 19 * 19 + qg * 19 + qb, 2)
+    return result
+
+
+def dominant_color(pixels: np.ndarray) -> str:
+    """Most common color of an ``(height, width, 3)`` uint8 array as ``#rrggbb``.
+
+    Pixels are bucketed to 4 bits per channel and the winning bucket is
+    averaged, which is stable against noise and JPEG artifacts.
+    """
+    flat = pixels.reshape(-1, 3)
+    buckets = flat >> 4
+    keys = (buckets[:, 0].astype(np.int32) << 8) | (buckets[:, 1].astype(np.int32) << 4) | buckets[:, 2]
+    winner = np.bincount(keys, minlength=4096).argmax()
+    r, g, b = flat[keys == winner].mean(axis=0).round().astype(int)
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def _resolve(host: str, allow_local: bool) -> str:
+    """Resolve ``host`` once and return the address to connect to.
+
+    Unless ``allow_local``, every address must be public, so client URLs
+    cannot reach private, loopback or link-local services. The request then
+    goes to the checked address, so a second lookup cannot be rebound.
+    """
+    try:
+        addresses = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(host, None)))
+    except socket.gaierror:
+        raise ValueError(f"Cannot resolve image host {host}")
+    if not allow_local:
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split("%")[0])
+            if not ip.is_global or ip.is_multicast:
+                raise ValueError(f"Image host {host} is not a public address")
+    return addresses[0]
+
+
+def _remaining(deadline: float, url: str) -> float:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise ValueError(f"Image download ran out of time: {url}")
+    return remaining
+
+
+def _open(url: str, allow_local: bool, deadline: float):
+    """Send a GET for ``url`` to the resolved address of its host"""
+    parsed = urlparse(url)
+    if not parsed.hostname:
+        raise ValueError(f"Image URL has no host: {url}")
+    address = _resolve(parsed.hostname, allow_local)
+    remaining = _remaining(deadline, url)
+    timeout = urllib3.Timeout(connect=min(CONNECT_TIMEOUT, remaining), read=min(READ_TIMEOUT, remaining))
+    if parsed.scheme == "https":
+        # TLS still names and verifies the URL's host, not the address
+        pool = urllib3.HTTPSConnectionPool(
+            address, parsed.port or 443, timeout=timeout, retries=False,
+            server_hostname=parsed.hostname, assert_hostname=parsed.hostname,
+            cert_reqs="CERT_REQUIRED", ca_certs=requests.certs.where(),
+        )
+    else:
+        pool = urllib3.HTTPConnectionPool(address, parsed.port or 80, timeout=timeout, retries=False)
+    target = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+    host_header = parsed.netloc.rpartition("@")[2]
+    try:
+        response = pool.urlopen("GET", target, headers={"Host": host_header},
+                                redirect=False, preload_content=False)
+    except BaseException:
+        pool.close()
+        raise
+    return pool, response
+
+
+def _download(url: str, allow_local: bool, deadline: float,
+              cancelled: Optional[threading.Event] = None) -> bytes:
+    """GET an http(s) URL by ``deadline``, checking the host of every redirect hop.
+
+    The body is read in chunks, each socket read waiting at most
+    ``READ_TIMEOUT``, so a host sending a byte at a time cannot keep the
+    download past its deadline.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        if urlparse(url).scheme not in ("http", "https"):
+            raise ValueError(f"Only http(s) image URLs are processed: {url}")
+        pool, response = _open(url, allow_local, deadline)
+        try:
+            location = response.get_redirect_location()
+            if location:
+                url = urljoin(url, location)
+                continue
+            if response.status >= 400:
+                raise ValueError(f"Image request failed with HTTP {response.status}: {url}")
+            data = bytearray()
+            while True:
+                _remaining(deadline, url)
+                if cancelled is not None and cancelled.is_set():
+                    raise ValueError(f"Image download cancelled: {url}")
+                chunk = response.read1(READ_CHUNK, decode_content=True)
+                if not chunk:
+                    return bytes(data)
+                data += chunk
+                if len(data) > MAX_DOWNLOAD_BYTES:
+                    raise ValueError(f"Image larger than {MAX_DOWNLOAD_BYTES} bytes: {url}")
+        finally:
+            response.release_conn()
+            pool.close()
+    raise ValueError(f"Too many redirects: {url}")
+
+
+def _read_source(source: str, allow_local: bool, deadline: float,
+                 cancelled: Optional[threading.Event] = None) -> bytes:
+    """Read image bytes from a public http(s) URL; with ``allow_local`` also
+    from private network hosts, file:// URLs and local paths"""
+    parsed = urlparse(source)
+    if parsed.scheme in ("http", "https"):
+        return _download(source, allow_local, deadline, cancelled)
+    if not allow_local:
+        raise ValueError(f"Only http(s) image URLs are processed: {source}")
+    path = Path(parsed.path) if parsed.scheme == "file" else Path(source)
+    return path.read_bytes()
+
+
+def describe_image(source: str, allow_local: bool = False, deadline: Optional[float] = None,
+                   cancelled: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """Compute width/height, dominant color and BlurHash for one image.
+
+    A download must finish by ``deadline`` (``time.monotonic()``), by
+    default ``IMAGE_DOWNLOAD_SECONDS`` from now, and gives up once
+    ``cancelled`` is set.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + IMAGE_DOWNLOAD_SECONDS
+    with Image.open(io.BytesIO(_read_source(source, allow_local, deadline, cancelled))) as image:
+        width, height = image.size
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ValueError(f"Image has {width}x{height} pixels, more than {MAX_IMAGE_PIXELS}: {source}")
+        # Lets JPEG decode at a reduced scale, far cheaper than a full decode
+        image.draft("RGB", (ANALYSIS_SIZE[0] * 2, ANALYSIS_SIZE[1] * 2))
+        image = image.convert("RGB")
+        image.thumbnail(ANALYSIS_SIZE)
+        pixels = np.asarray(image, dtype=np.uint8)
+    return {
+        "url": source,
+        "width": width,
+        "height": height,
+        "color": dominant_color(pixels),
+        "blurhash": blurhash(pixels),
+    }
+
+
+def project_image_urls(project) -> List[str]:
+    """Every image URL a project references, thumbnail first, without duplicates"""
+    urls = [project.get("thumbnail_image")]
+    urls += project.get("static_images") or []
+    urls += project.get("carousel_images") or []
+    return list(dict.fromkeys(url for url in urls if url))
+
+
+def describe_project_images(project, force: bool = False, allow_local: bool = False,
+                            cancelled: Optional[threading.Event] = None) -> Optional[List[Dict[str, Any]]]:
+    """Return the project's new ``images`` list, or ``None`` if it is unchanged.
+
+    Metadata already stored for a URL is reused, so only added or changed
+    URLs are fetched. An image that fails to load, or is not reached within
+    ``IMAGE_JOB_SECONDS`` or before ``cancelled`` is set, is left out and
+    retried on the next run. Only the first ``MAX_IMAGES_PER_PROJECT`` URLs
+    are described. ``allow_local`` is only for trusted URLs such as fixtures.
+    """
+    existing = {} if force else {image["url"]: image for image in project.get("images") or []}
+    images = []
+    urls = project_image_urls(project)
+    if len(urls) > MAX_IMAGES_PER_PROJECT:
+        logging.warning(f"Describing only the first {MAX_IMAGES_PER_PROJECT} of {len(urls)} images")
+    job_deadline = time.monotonic() + IMAGE_JOB_SECONDS
+    postponed = 0
+    for url in urls[:MAX_IMAGES_PER_PROJECT]:
+        if url in existing:
+            images.append(existing[url])
+            continue
+        if time.monotonic() >= job_deadline or (cancelled is not None and cancelled.is_set()):
+            postponed += 1
+            continue
+        deadline = min(job_deadline, time.monotonic() + IMAGE_DOWNLOAD_SECONDS)
+        try:
+            images.append(describe_image(url, allow_local, deadline, cancelled))
+        except Exception as e:
+            logging.warning(f"Skipping image {url}: {str(e)}")
+    if postponed:
+        logging.warning(f"Out of time, left {postponed} images for the next run")
+    if not force and images == (project.get("images") or []):
+        return None
+    return images
+
+
+async def process_all_projects(force: bool = False, allow_local: bool = False):
+    """Refresh image metadata on every project of every tenant.
+
+    Updates go through the repository, so they are logged for live updates
+    and re-exported to the snapshot like any other write.
+    """
+    from jobs import JobQueue
+    from repository import MongoRepository
+    jobs = JobQueue()
+    jobs.start()
+    repository = MongoRepository(snapshot_path=os.environ.get('SNAPSHOT_PATH'), jobs=jobs)
+    updated = 0
+    try:
+        async for project in repository.projects.find({}):
+            images = await asyncio.to_thread(describe_project_images, project, force, allow_local)
+            if images is not None:
+                await repository.update_project(project.get("tenant"), project["id"], {"$set": {"images": images}})
+                updated += 1
+        await jobs.stop()
+        print(f"Updated image metadata on {updated} projects")
+    finally:
+        await repository.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(process_all_projects(force="--force" in sys.argv, allow_local="--allow-local" in sys.argv))
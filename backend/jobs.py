@@ -0,0 +1,156 @@
+"""Bounded in-process queue for side work that follows a write."""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 1000))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_DRAIN_SECONDS = float(os.environ.get('JOB_DRAIN_SECONDS', 10))
+
+
+class _Job:
+    __slots__ = ("key", "func", "args", "attempt", "enqueued")
+
+    def __init__(self, key, func, args, attempt=1):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.attempt = attempt
+        self.enqueued = time.monotonic()
+
+
+class JobQueue:
+    """Runs coroutine jobs on a fixed pool of worker tasks.
+
+    Jobs are identified by a key; submitting a key that is already waiting
+    is a no-op, so a burst of writes triggers one rebuild rather than many.
+    A job that is already running does not absorb new submissions, since it
+    may have read the data before the latest write. Failures are retried
+    with exponential backoff and jitter up to ``max_attempts``.
+    """
+
+    def __init__(self, maxsize: int = JOB_QUEUE_SIZE, workers: int = JOB_WORKERS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, backoff: float = 0.5, backoff_max: float = 30):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending = set()
+        self._retries = {}
+        self._tasks = []
+        self._closing = False
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.deduplicated = 0
+        self._wait_total = self._wait_max = 0.0
+        self._run_total = self._run_max = 0.0
+
+    def start(self):
+        self._queue = asyncio.Queue(self.maxsize)
+        self._closing = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args) -> bool:
+        """Queue ``func(*args)``; returns False if the job was not accepted"""
+        if self._queue is None or self._closing:
+            return False
+        if key in self._pending:
+            self.deduplicated += 1
+            return True
+        return self._enqueue(_Job(key, func, args))
+
+    def _enqueue(self, job: _Job) -> bool:
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logging.warning(f"Job queue full, dropping job {job.key!r}")
+            return False
+        self._pending.add(job.key)
+        return True
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self._pending.discard(job.key)
+            started = time.monotonic()
+            wait = started - job.enqueued
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self.running += 1
+            try:
+                await job.func(*job.args)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._retry(job, e)
+            finally:
+                elapsed = time.monotonic() - started
+                self._run_total += elapsed
+                self._run_max = max(self._run_max, elapsed)
+                self.running -= 1
+                self._queue.task_done()
+
+    def _retry(self, job: _Job, error: Exception):
+        if job.attempt >= self.max_attempts or self._closing:
+            self.failed += 1
+            logging.error(f"Job {job.key!r} failed after {job.attempt} attempts: {str(error)}")
+            return
+        delay = min(self.backoff * 2 ** (job.attempt - 1), self.backoff_max)
+        delay *= random.uniform(0.5, 1.0)
+        retry = _Job(job.key, job.func, job.args, job.attempt + 1)
+        self.retried += 1
+        self._retries[retry] = asyncio.get_running_loop().call_later(delay, self._resubmit, retry)
+
+    def _resubmit(self, job: _Job):
+        self._retries.pop(job, None)
+        # A fresh submission of the same key already covers this retry
+        if job.key not in self._pending:
+            job.enqueued = time.monotonic()
+            self._enqueue(job)
+
+    async def stop(self, timeout: float = JOB_DRAIN_SECONDS):
+        """Stop accepting jobs, run what is queued (retries included), then stop the workers"""
+        if self._queue is None:
+            return
+        self._closing = True
+        for job, handle in list(self._retries.items()):
+            handle.cancel()
+            self._resubmit(job)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Job queue drain timed out with {self._queue.qsize()} jobs left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def stats(self):
+        started = self.completed + self.failed + self.retried
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "capacity": self.maxsize,
+            "running": self.running,
+            "retrying": len(self._retries),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "deduplicated": self.deduplicated,
+            "wait_ms_avg": round(self._wait_total / started * 1000, 2) if started else 0,
+            "wait_ms_max": round(self._wait_max * 1000, 2),
+            "run_ms_avg": round(self._run_total / started * 1000, 2) if started else 0,
+            "run_ms_max": round(self._run_max * 1000, 2),
+        }
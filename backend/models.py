@@ -61,6 +61,13 @@ class ServiceUpdate(BaseModel):
     order: Optional[int] = None
     active: Optional[bool] = None
 
+class ImageMeta(BaseModel):
+    url: str
+    width: int
+    height: int
+    color: str  # Dominant color as #rrggbb
+    blurhash: str  # Compact placeholder, see images.py
+
 class Project(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     title: str
@@ -74,6 +81,7 @@ class Project(BaseModel):
     thumbnail_image: Optional[str] = None  # Main thumbnail for cards
     static_images: Optional[List[str]] = []  # Static images for detail page
     carousel_images: Optional[List[str]] = []  # Images for carousel
+    images: Optional[List[ImageMeta]] = []  # Precomputed metadata for the images above
     order: Optional[int] = 0
     active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,221 @@
+"""Compile JSON Merge Patch (RFC 7396) and JSON Patch (RFC 6902) documents
+into minimal dotted-path MongoDB update operators."""
+from functools import lru_cache
+from typing import Any, Dict, List, Union, get_args, get_origin
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+MERGE_PATCH_CONTENT_TYPE = "application/merge-patch+json"
+JSON_PATCH_CONTENT_TYPE = "application/json-patch+json"
+
+
+class PatchError(ValueError):
+    """Raised when a patch document cannot be compiled into a Mongo update"""
+
+
+def _unwrap_optional(annotation):
+    """Strip Optional[...] from an annotation"""
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return _unwrap_optional(args[0])
+    return annotation
+
+
+def _admits_none(annotation) -> bool:
+    """Whether the declared annotation accepts ``None`` (a default does not count)"""
+    if annotation in (Any, None, type(None)):
+        return True
+    return get_origin(annotation) is Union and type(None) in get_args(annotation)
+
+
+def _is_model(annotation) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _is_list(annotation) -> bool:
+    return get_origin(annotation) in (list, List)
+
+
+@lru_cache(maxsize=None)
+def _adapter(annotation) -> TypeAdapter:
+    return TypeAdapter(annotation)
+
+
+def _validate(annotation, value, path: str):
+    """Validate a value against the field annotation and return its plain form"""
+    adapter = _adapter(annotation)
+    try:
+        return adapter.dump_python(adapter.validate_python(value))
+    except ValidationError as e:
+        raise PatchError(f"Invalid value for '{path}': {e.errors()[0]['msg']}")
+
+
+class _Field:
+    """A resolved patch target: its annotation and whether it may be removed"""
+
+    def __init__(self, annotation, nullable: bool, in_list: bool):
+        self.annotation = _unwrap_optional(annotation)
+        self.nullable = nullable
+        self.in_list = in_list
+
+
+def _resolve(model, writable, segments: List[str]) -> _Field:
+    """Walk the model schema along the path segments"""
+    if not segments:
+        raise PatchError("Patch path must not target the whole document")
+    if segments[0] not in writable:
+        raise PatchError(f"Field '{segments[0]}' cannot be patched")
+
+    annotation, nullable, in_list = model, False, False
+    for i, segment in enumerate(segments):
+        path = ".".join(segments[:i + 1])
+        annotation = _unwrap_optional(annotation)
+        if _is_model(annotation):
+            field = annotation.model_fields.get(segment)
+            if field is None:
+                raise PatchError(f"Unknown field '{path}'")
+            annotation, nullable, in_list = field.annotation, _admits_none(field.annotation), False
+        elif _is_list(annotation):
+            if segment != "-" and not segment.isdigit():
+                raise PatchError(f"Invalid array index in '{path}'")
+            annotation, nullable, in_list = get_args(annotation)[0], False, True
+        else:
+            raise PatchError(f"Path '{path}' does not address a nested field")
+    return _Field(annotation, nullable, in_list)
+
+
+class _UpdateBuilder:
+    """Collects operators and rejects paths Mongo would consider conflicting"""
+
+    def __init__(self):
+        self.operators: Dict[str, Dict[str, Any]] = {}
+        self.paths: Dict[str, str] = {}
+
+    def _claim(self, path: str, operator: str):
+        for existing, existing_operator in self.paths.items():
+            if existing == path and existing_operator == operator and operator in ("$push", "$pull"):
+                continue
+            if existing == path or existing.startswith(path + ".") or path.startswith(existing + "."):
+                raise PatchError(f"Conflicting changes to '{existing}' and '{path}'")
+        self.paths[path] = operator
+
+    def set(self, path: str, value):
+        self._claim(path, "$set")
+        self.operators.setdefault("$set", {})[path] = value
+
+    def unset(self, path: str):
+        self._claim(path, "$unset")
+        self.operators.setdefault("$unset", {})[path] = ""
+
+    def push(self, path: str, value, position: int = None):
+        self._claim(path, "$push")
+        push = self.operators.setdefault("$push", {})
+        if path in push:
+            if position is not None or "$position" in push[path]:
+                raise PatchError(f"Only one positional insert is allowed per array ('{path}')")
+            push[path]["$each"].append(value)
+            return
+        push[path] = {"$each": [value]}
+        if position is not None:
+            push[path]["$position"] = position
+
+    def pull(self, path: str, value):
+        self._claim(path, "$pull")
+        pull = self.operators.setdefault("$pull", {})
+        pull.setdefault(path, {"$in": []})["$in"].append(value)
+
+    def compile(self) -> Dict[str, Dict[str, Any]]:
+        update = dict(self.operators)
+        # Single-element $push/$pull do not need the $each/$in wrappers
+        for path, spec in update.get("$push", {}).items():
+            if len(spec) == 1 and len(spec["$each"]) == 1:
+                update["$push"][path] = spec["$each"][0]
+        for path, spec in update.get("$pull", {}).items():
+            if len(spec["$in"]) == 1 and not isinstance(spec["$in"][0], dict):
+                update["$pull"][path] = spec["$in"][0]
+        return update
+
+
+def merge_patch_to_update(patch: Dict[str, Any], model, writable) -> Dict[str, Dict[str, Any]]:
+    """Compile an RFC 7396 merge patch into $set/$unset operators.
+
+    Nested objects are descended into so only the leaves that actually change
+    are written; ``null`` removes a field whose type admits ``None``.
+    """
+    if not isinstance(patch, dict):
+        raise PatchError("Merge patch must be a JSON object")
+    builder = _UpdateBuilder()
+
+    def walk(node: Dict[str, Any], prefix: List[str]):
+        for key, value in node.items():
+            segments = prefix + [key]
+            path = ".".join(segments)
+            field = _resolve(model, writable, segments)
+            if value is None:
+                if not field.nullable:
+                    raise PatchError(f"Field '{path}' cannot be removed")
+                builder.unset(path)
+            elif isinstance(value, dict) and _is_model(field.annotation):
+                walk(value, segments)
+            else:
+                builder.set(path, _validate(field.annotation, value, path))
+
+    walk(patch, [])
+    return builder.compile()
+
+
+def _parse_pointer(pointer) -> List[str]:
+    """Split an RFC 6901 JSON pointer into unescaped segments"""
+    if not isinstance(pointer, str) or not pointer.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer '{pointer}'")
+    return [segment.replace("~1", "/").replace("~0", "~") for segment in pointer[1:].split("/")]
+
+
+def json_patch_to_update(operations: List[Dict[str, Any]], model, writable) -> Dict[str, Dict[str, Any]]:
+    """Compile an RFC 6902 patch into $set/$unset/$push/$pull operators.
+
+    ``add`` on an array index or ``-`` becomes a ``$push``. Because Mongo
+    cannot remove an array element by index atomically, ``remove`` on an
+    array accepts a ``value`` member and pulls the matching elements instead.
+    """
+    if not isinstance(operations, list):
+        raise PatchError("JSON Patch must be an array of operations")
+    builder = _UpdateBuilder()
+
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise PatchError("JSON Patch operations must be objects")
+        op = operation.get("op")
+        segments = _parse_pointer(operation.get("path"))
+        path = ".".join(segments)
+        field = _resolve(model, writable, segments)
+
+        if op in ("add", "replace"):
+            if "value" not in operation:
+                raise PatchError(f"Operation '{op}' on '{path}' requires a value")
+            value = _validate(field.annotation, operation["value"], path)
+            last = segments[-1]
+            if op == "add" and field.in_list:
+                parent = ".".join(segments[:-1])
+                builder.push(parent, value, None if last == "-" else int(last))
+            elif last == "-":
+                raise PatchError(f"Operation 'replace' cannot target the end of an array ('{path}')")
+            else:
+                builder.set(path, value)
+        elif op == "remove":
+            if "value" in operation:
+                if not _is_list(field.annotation):
+                    raise PatchError(f"Remove by value requires an array ('{path}')")
+                item = get_args(field.annotation)[0]
+                builder.pull(path, _validate(item, operation["value"], path))
+            elif field.in_list:
+                raise PatchError(f"Removing array elements by index is not supported; pass a value ('{path}')")
+            elif not field.nullable:
+                raise PatchError(f"Field '{path}' cannot be removed")
+            else:
+                builder.unset(path)
+        else:
+            raise PatchError(f"Unsupported JSON Patch operation '{op}'")
+
+    return builder.compile()
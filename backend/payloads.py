@@ -0,0 +1,401 @@
+"""Memory-mapped snapshot of pre-encoded public payloads, shared by all workers.
+
+One refresher process writes every tenant's portfolio, services, projects and
+project detail responses, already JSON encoded, into a single versioned file.
+Workers map it read-only: the OS keeps one copy in the page cache for all of
+them, a read is a dict lookup plus a ``memoryview`` slice handed to the
+transport, and a new version is picked up by remapping after ``os.replace``.
+
+File layout (little endian)::
+
+    header   magic (8s) | version (Q) | built_at (d) | index_offset (Q) | index_length (Q)
+    bodies   concatenated response bodies
+    index    JSON {tenant: [built_at, {key: [offset, length]}]}, tenant "" in single mode
+
+Each tenant records when its documents were read, since a rebuild after a
+write only re-reads the tenants that changed.
+
+Run ``python payloads.py [path]`` to write a snapshot once, or with
+``--watch`` to run the refresher as its own process.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from starlette.responses import Response
+
+from repository import LIST_LIMIT, MongoRepository, json_default, public_document, read_public_dataset
+from tenancy import TENANT_MODE
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+PAYLOAD_SNAPSHOT_PATH = os.environ.get('PAYLOAD_SNAPSHOT_PATH')
+# Quiet period after a change before rebuilding, so bursts share one build
+PAYLOAD_REFRESH_SECONDS = float(os.environ.get('PAYLOAD_REFRESH_SECONDS', 1))
+# Rebuild at least this often, for writes that bypass the change log
+PAYLOAD_MAX_AGE = float(os.environ.get('PAYLOAD_MAX_AGE', 60))
+# How often a worker that is not the refresher retries taking over
+PAYLOAD_LEADER_RETRY_SECONDS = 5
+
+MAGIC = b"PFPAYLD2"
+HEADER = struct.Struct("<8sQdQQ")
+
+
+def _encode(data) -> bytes:
+    """Encode a response body exactly as the handlers' JSONResponse would"""
+    return json.dumps(
+        {"success": True, "data": data},
+        ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=json_default,
+    ).encode("utf-8")
+
+
+def _public(document):
+    return public_document(document)[1]
+
+
+def build_payloads(portfolios, services, projects, single_tenant: bool = True) -> Dict[str, Dict[str, bytes]]:
+    """Encode every public read response from raw documents, per tenant.
+
+    Keys are ``portfolio``, ``services``, ``projects`` and ``project:<id>``
+    with the raw ``id`` the detail endpoint looks up. In single-tenant mode
+    all documents belong to tenant ``""``, as unscoped queries would see them.
+    """
+    grouped = defaultdict(lambda: {"portfolio": [], "services": [], "projects": []})
+    for collection, documents in (("portfolio", portfolios), ("services", services), ("projects", projects)):
+        for document in documents:
+            tenant = "" if single_tenant else document.get("tenant")
+            if tenant is not None:
+                grouped[tenant][collection].append(document)
+
+    payloads = {}
+    for tenant, collections in grouped.items():
+        entries = {
+            "services": _encode([_public(d) for d in collections["services"][:LIST_LIMIT]]),
+            "projects": _encode([_public(d) for d in collections["projects"][:LIST_LIMIT]]),
+        }
+        if collections["portfolio"]:
+            entries["portfolio"] = _encode(_public(collections["portfolio"][0]))
+        for project in collections["projects"]:
+            key = f"project:{project.get('id')}"
+            if key not in entries:
+                entries[key] = _encode(_public(project))
+        payloads[tenant] = entries
+    return payloads
+
+
+def _read_header(data):
+    magic, version, built_at, index_offset, index_length = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a payload snapshot")
+    return version, built_at, index_offset, index_length
+
+
+def _previous_version(path: Path) -> int:
+    try:
+        with open(path, "rb") as f:
+            return _read_header(f.read(HEADER.size))[0]
+    except (OSError, ValueError, struct.error):
+        return 0
+
+
+TenantPayloads = Dict[str, Tuple[float, Dict[str, bytes]]]
+
+
+def write_payload_snapshot(path, payloads: TenantPayloads, built_at: float) -> int:
+    """Atomically write a payload snapshot and return its version.
+
+    ``payloads`` maps each tenant to the wall-clock time its documents were
+    read and its encoded bodies; workers bypass the snapshot for a tenant
+    they wrote to after that time. ``built_at`` is when this build started.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    version = _previous_version(path) + 1
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(bytes(HEADER.size))
+            offset = HEADER.size
+            index = {}
+            for tenant, (tenant_built_at, entries) in payloads.items():
+                offsets = {}
+                for key, body in entries.items():
+                    f.write(body)
+                    offsets[key] = [offset, len(body)]
+                    offset += len(body)
+                index[tenant] = [tenant_built_at, offsets]
+            encoded_index = json.dumps(index, separators=(",", ":")).encode("utf-8")
+            f.write(encoded_index)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, version, built_at, offset, len(encoded_index)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return version
+
+
+class PayloadResponse(Response):
+    """JSON response whose body is a slice of the mapped snapshot, sent without copying"""
+
+    media_type = "application/json"
+
+    def __init__(self, body: memoryview, version: int):
+        super().__init__(body, headers={"X-Payload-Version": str(version)})
+
+    def render(self, content):
+        return content
+
+
+class _Mapping:
+    __slots__ = ("stamp", "version", "built_at", "size", "view", "index")
+
+    def __init__(self, path, stamp):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        version, built_at, index_offset, index_length = _read_header(mapped)
+        self.stamp = stamp
+        self.version = version
+        self.built_at = built_at
+        self.size = len(mapped)
+        self.index = json.loads(mapped[index_offset:index_offset + index_length])
+        # Responses in flight hold slices of this view, which keeps the old
+        # mapping alive after a swap; it is unmapped once they are sent
+        self.view = memoryview(mapped)
+
+
+class PayloadSnapshot:
+    """Read side: serves responses from the mapped snapshot file.
+
+    The file is checked on every read, like ``SnapshotRepository``, and a
+    replaced file is remapped; swapping is a single attribute assignment, so
+    a request sees either the old or the new version, never a mix. A miss
+    returns ``None`` and the caller falls back to the repository.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._mapping: Optional[_Mapping] = None
+        # Tenant -> time of this worker's last write, to keep its own reads fresh
+        self._written: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def _current(self) -> Optional[_Mapping]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self._mapping
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if self._mapping is None or stamp != self._mapping.stamp:
+            try:
+                self._mapping = _Mapping(self.path, stamp)
+            except (OSError, ValueError, struct.error) as e:
+                logging.warning(f"Could not map payload snapshot {self.path}: {str(e)}")
+        return self._mapping
+
+    def mark_written(self, tenant: Optional[str]):
+        """Bypass the snapshot for ``tenant`` until a version built after now"""
+        self._written[tenant or ""] = time.time()
+
+    def response(self, tenant: Optional[str], key: str) -> Optional[PayloadResponse]:
+        mapping = self._current()
+        if mapping is None:
+            self.misses += 1
+            return None
+        tenant = tenant or ""
+        tenant_index = mapping.index.get(tenant)
+        written = self._written.get(tenant)
+        if written is not None:
+            if tenant_index is None or written >= tenant_index[0]:
+                self.bypassed += 1
+                return None
+            del self._written[tenant]
+        entry = tenant_index[1].get(key) if tenant_index else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        offset, length = entry
+        return PayloadResponse(mapping.view[offset:offset + length], mapping.version)
+
+    def stats(self):
+        mapping = self._mapping
+        return {
+            "version": mapping.version if mapping else None,
+            "age_s": round(time.time() - mapping.built_at, 2) if mapping else None,
+            "bytes": mapping.size if mapping else 0,
+            "tenants": len(mapping.index) if mapping else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+        }
+
+
+class PayloadRefresher:
+    """Write side: rebuilds the snapshot after changes, in one process only.
+
+    Every worker may start one; an exclusive ``flock`` on ``<path>.lock``
+    elects the refresher, and the others retry so one takes over if it dies.
+    Changes are noticed by tailing the Mongo change log, so writes made by
+    any worker trigger a rebuild. Only the tenants named in the log are
+    re-read; the other tenants' bodies are carried over from the last
+    build, and everything is re-read every ``PAYLOAD_MAX_AGE`` seconds.
+    """
+
+    def __init__(self, path, single_tenant: bool = TENANT_MODE == "single"):
+        self.path = str(path)
+        self.single_tenant = single_tenant
+        self._lock_file = None
+        self._dirty: Optional[asyncio.Event] = None
+        self._dirty_tenants: Set[str] = set()
+        self._payloads: TenantPayloads = {}
+        self._tasks = []
+        self.builds = 0
+        self.full_builds = 0
+        self.failures = 0
+        self.version = None
+        self._build_ms = 0.0
+
+    @property
+    def leader(self) -> bool:
+        return self._lock_file is not None
+
+    def start(self):
+        self._dirty = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _acquire(self) -> bool:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _run(self):
+        while not self._acquire():
+            await asyncio.sleep(PAYLOAD_LEADER_RETRY_SECONDS)
+        logging.info(f"Refreshing payload snapshot {self.path} from this process")
+        repository = MongoRepository()
+        self._tasks.append(asyncio.create_task(self._watch(repository)))
+        last_full = None
+        while True:
+            full = (
+                last_full is None
+                or not self._dirty_tenants
+                or time.monotonic() - last_full >= PAYLOAD_MAX_AGE
+            )
+            tenants = None if full else sorted(self._dirty_tenants)
+            self._dirty_tenants = set()
+            self._dirty.clear()
+            try:
+                await self.refresh(repository, tenants)
+                if full:
+                    last_full = time.monotonic()
+            except Exception as e:
+                self.failures += 1
+                # Tenants that were not rebuilt wait for the next full build
+                last_full = None
+                logging.error(f"Error writing payload snapshot: {str(e)}")
+            timeout = PAYLOAD_MAX_AGE
+            if last_full is not None:
+                timeout -= time.monotonic() - last_full
+            try:
+                await asyncio.wait_for(self._dirty.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(PAYLOAD_REFRESH_SECONDS)
+
+    async def _watch(self, repository: MongoRepository):
+        while True:
+            try:
+                async for entry in repository.tail_changes():
+                    self._dirty_tenants.add(entry.get("tenant") or "")
+                    self._dirty.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error tailing change log: {str(e)}")
+            await asyncio.sleep(1)
+
+    async def refresh(self, repository: MongoRepository, tenants: Optional[List[str]] = None) -> int:
+        """Re-read ``tenants`` (every tenant when ``None``) and write a new snapshot version"""
+        if self.single_tenant:
+            # Tenant "" is every document, so there is nothing smaller to re-read
+            tenants = None
+        started = time.perf_counter()
+        built_at = time.time()
+        dataset = await read_public_dataset(repository, tenants)
+
+        def build():
+            fresh = build_payloads(*dataset, single_tenant=self.single_tenant)
+            payloads = {} if tenants is None else {
+                tenant: payload for tenant, payload in self._payloads.items() if tenant not in tenants
+            }
+            payloads.update((tenant, (built_at, entries)) for tenant, entries in fresh.items())
+            return payloads, write_payload_snapshot(self.path, payloads, built_at)
+
+        self._payloads, self.version = await asyncio.to_thread(build)
+        self.builds += 1
+        self.full_builds += tenants is None
+        self._build_ms = (time.perf_counter() - started) * 1000
+        return self.version
+
+    def stats(self):
+        return {
+            "leader": self.leader,
+            "version": self.version,
+            "builds": self.builds,
+            "full_builds": self.full_builds,
+            "failures": self.failures,
+            "build_ms": round(self._build_ms, 2),
+        }
+
+
+async def main(path, watch: bool):
+    refresher = PayloadRefresher(path)
+    if watch:
+        refresher.start()
+        await asyncio.Event().wait()
+    repository = MongoRepository()
+    try:
+        version = await refresher.refresh(repository)
+        print(f"Payload snapshot version {version} written to {path}")
+    finally:
+        await repository.close()
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--watch"]
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args[0] if args else PAYLOAD_SNAPSHOT_PATH, watch="--watch" in sys.argv))
@@ -0,0 +1,172 @@
+"""Precomputed "related projects" per tenant.
+
+Each active project is described by its categories, client and year. Pairwise
+scores are a weighted sum of category Jaccard similarity, same-client and
+year proximity, computed with NumPy over all of a tenant's projects. The
+top-k table is cached so a lookup is a row slice. Projects are keyed on the
+raw ``id`` the ``/projects/{id}`` routes look up.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+RELATED_TOP_K = 8
+RELATED_MAX_TENANTS = int(os.environ.get('RELATED_MAX_TENANTS', 1000))
+# Rebuild from storage at most this often to pick up other workers' writes
+RELATED_TTL = float(os.environ.get('RELATED_TTL', 60))
+
+CATEGORY_WEIGHT = 0.7
+CLIENT_WEIGHT = 0.2
+YEAR_WEIGHT = 0.1
+# Years this far apart score 1/e on proximity
+YEAR_SCALE = 3.0
+
+
+def _year(project) -> float:
+    try:
+        return float(str(project.get("year") or "").strip()[:4])
+    except ValueError:
+        return np.nan
+
+
+def _signature(project):
+    return (tuple(sorted(project.get("category") or [])), project.get("client"), project.get("year"))
+
+
+class RelatedIndex:
+    """Similarity matrix and top-k table for one tenant's projects"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.projects: List[Dict[str, Any]] = []
+        self.signatures: Dict[str, tuple] = {}
+        self.categories: Dict[str, int] = {}
+        self.clients: Dict[str, int] = {}
+        self.scores = np.zeros((0, 0))
+        self.top_index = np.zeros((0, 0), dtype=int)
+        self.top_score = np.zeros((0, 0))
+        self.built = 0.0
+
+    def _features(self, projects):
+        n = len(projects)
+        category_matrix = np.zeros((n, len(self.categories)), dtype=np.float32)
+        for row, project in enumerate(projects):
+            for category in project.get("category") or []:
+                category_matrix[row, self.categories[category]] = 1
+        client_codes = np.array([self.clients.get(p.get("client"), -1) for p in projects], dtype=int)
+        years = np.array([_year(p) for p in projects], dtype=float)
+        self.category_matrix = category_matrix
+        self.category_sizes = category_matrix.sum(axis=1)
+        self.client_codes = client_codes
+        self.years = years
+
+    def _similarity(self, rows: np.ndarray) -> np.ndarray:
+        """Scores of ``rows`` against every project, shape ``(len(rows), n)``"""
+        intersection = self.category_matrix[rows] @ self.category_matrix.T
+        union = self.category_sizes[rows, None] + self.category_sizes[None, :] - intersection
+        jaccard = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+        codes = self.client_codes
+        same_client = (codes[rows, None] == codes[None, :]) & (codes[rows, None] >= 0)
+
+        proximity = np.exp(-np.abs(self.years[rows, None] - self.years[None, :]) / YEAR_SCALE)
+        proximity = np.nan_to_num(proximity, nan=0.0)
+
+        scores = CATEGORY_WEIGHT * jaccard + CLIENT_WEIGHT * same_client + YEAR_WEIGHT * proximity
+        scores[np.arange(len(rows)), rows] = -np.inf
+        return scores
+
+    def refresh(self, keyed_projects: List[Tuple[str, Dict[str, Any]]]):
+        """Update the index to ``(id, project)`` pairs, recomputing only what changed.
+
+        When the category and client vocabularies are unchanged, the old
+        matrix is reindexed and only rows/columns of new or edited projects
+        are recomputed; otherwise the matrix is rebuilt.
+        """
+        ids = [project_id for project_id, _ in keyed_projects]
+        projects = [project for _, project in keyed_projects]
+        signatures = {project_id: _signature(project) for project_id, project in keyed_projects}
+        categories = sorted({c for project in projects for c in project.get("category") or []})
+        clients = sorted({project["client"] for project in projects if project.get("client")})
+        vocabulary_changed = categories != list(self.categories) or clients != list(self.clients)
+
+        self.categories = {category: i for i, category in enumerate(categories)}
+        self.clients = {client: i for i, client in enumerate(clients)}
+        self._features(projects)
+
+        previous = {project_id: i for i, project_id in enumerate(self.ids)}
+        changed = [
+            i for i, project_id in enumerate(ids)
+            if self.signatures.get(project_id) != signatures[project_id]
+        ]
+        if vocabulary_changed or not previous:
+            scores = self._similarity(np.arange(len(ids)))
+        else:
+            old = np.array([previous.get(project_id, -1) for project_id in ids], dtype=int)
+            scores = np.zeros((len(ids), len(ids)))
+            kept = np.flatnonzero(old >= 0)
+            scores[np.ix_(kept, kept)] = self.scores[np.ix_(old[kept], old[kept])]
+            if changed:
+                rows = np.array(changed, dtype=int)
+                fresh = self._similarity(rows)
+                scores[rows, :] = fresh
+                scores[:, rows] = fresh.T
+
+        self.ids = ids
+        self.projects = projects
+        self.signatures = signatures
+        self.scores = scores
+        self._rank()
+        self.built = time.monotonic()
+
+    def _rank(self):
+        n = len(self.ids)
+        k = min(RELATED_TOP_K, max(n - 1, 0))
+        if k == 0:
+            self.top_index = np.zeros((n, 0), dtype=int)
+            self.top_score = np.zeros((n, 0))
+            return
+        candidates = np.argpartition(-self.scores, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(self.scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")
+        self.top_index = np.take_along_axis(candidates, order, axis=1)
+        self.top_score = np.take_along_axis(candidate_scores, order, axis=1)
+
+    def related(self, project_id: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        try:
+            row = self.ids.index(project_id)
+        except ValueError:
+            return None
+        return [
+            {**self.projects[i], "score": round(float(score), 4)}
+            for i, score in zip(self.top_index[row, :limit], self.top_score[row, :limit])
+            if score > 0
+        ]
+
+
+class RelatedProjects:
+    """Per-tenant ``RelatedIndex`` registry, least recently used tenants evicted"""
+
+    def __init__(self, repository):
+        self.repository = repository
+        self._indexes: "OrderedDict[Optional[str], RelatedIndex]" = OrderedDict()
+
+    async def refresh(self, tenant: Optional[str]) -> RelatedIndex:
+        index = self._indexes.get(tenant) or RelatedIndex()
+        index.refresh(await self.repository.list_projects_by_key(tenant))
+        self._indexes[tenant] = index
+        self._indexes.move_to_end(tenant)
+        while len(self._indexes) > RELATED_MAX_TENANTS:
+            self._indexes.popitem(last=False)
+        return index
+
+    async def related(self, tenant: Optional[str], project_id: str, limit: int):
+        index = self._indexes.get(tenant)
+        if index is None or time.monotonic() - index.built > RELATED_TTL:
+            index = await self.refresh(tenant)
+        else:
+            self._indexes.move_to_end(tenant)
+        return index.related(project_id, limit)
@@ -0,0 +1,776 @@
+"""Storage backends behind the API handlers.
+
+``MongoRepository`` is the read/write primary backed by Motor.
+``SnapshotRepository`` serves reads from a local SQLite snapshot file exported
+from Mongo, so read-only edge nodes never open a database connection.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import requests
+from dotenv import load_dotenv
+from pymongo import ASCENDING, CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from cache import TenantCache
+from jobs import JobQueue
+from tracing import query_span, span
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Mirrors the to_list(100) limit the list endpoints have always used
+LIST_LIMIT = 100
+
+# Tenant ownership is internal and never returned to clients
+TENANT_PROJECTION = {"tenant": 0}
+
+CHANGES_CAP_BYTES = int(os.environ.get('CHANGES_CAP_BYTES', 16 * 1024 * 1024))
+# How long a hole in the sequence may be waited on before it is assumed to
+# come from a writer that failed between allocating and logging its change
+CHANGE_GAP_GRACE = timedelta(seconds=5)
+# Entries re-read when a tail cursor is reopened: anything logged this long
+# before the newest entry seen may still have been inserted after it
+CHANGE_TAIL_WINDOW = timedelta(seconds=60)
+# Pause before reopening a tail cursor that died
+CHANGE_TAIL_RETRY_SECONDS = 1
+
+# How often an edge node asks SNAPSHOT_SOURCE_URL for a newer snapshot
+SNAPSHOT_PULL_SECONDS = float(os.environ.get('SNAPSHOT_PULL_SECONDS', 5))
+
+# Mongo error codes for an update path that the stored document cannot take,
+# e.g. a dotted $set below a null sub-document or a $push onto a null array
+PATH_CONFLICT_CODES = {2, 14, 28}
+
+
+class ReadOnlyRepositoryError(Exception):
+    """Raised when a write is attempted against a read-only backend"""
+
+
+class UpdateConflictError(Exception):
+    """Raised when an update does not fit the shape of the stored document"""
+
+
+class SnapshotUnavailableError(Exception):
+    """Raised when a snapshot-backed node has no snapshot file to serve yet"""
+
+
+class Repository:
+    """Storage interface used by the API handlers.
+
+    Every method is scoped to a tenant; ``None`` means single-tenant mode
+    and leaves queries unscoped. Reads return documents already passed
+    through ``convert_object_id``. Updates take Mongo update operators and
+    return the updated document, or ``None`` when nothing matched; an empty
+    update just reads it back.
+    """
+    read_only = False
+    has_change_log = False
+
+    async def get_portfolio(self, tenant: Optional[str]) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def update_portfolio(self, tenant: Optional[str], update) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def list_services(self, tenant: Optional[str]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def create_service(self, tenant: Optional[str], document) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def update_service(self, tenant: Optional[str], service_id: str, update) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def delete_service(self, tenant: Optional[str], service_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def list_projects(self, tenant: Optional[str]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def list_projects_by_key(self, tenant: Optional[str]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Active projects as ``(id, project)`` pairs, where ``id`` is the raw
+        ``id`` that ``get_project`` and the ``/projects/{id}`` routes look up"""
+        raise NotImplementedError
+
+    async def get_project(self, tenant: Optional[str], project_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def create_project(self, tenant: Optional[str], document) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def update_project(self, tenant: Optional[str], project_id: str, update) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def delete_project(self, tenant: Optional[str], project_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def list_changes(self, tenant: Optional[str], since: int, limit: int) -> Dict[str, Any]:
+        """Return change-log entries after ``since`` (see ``MongoRepository``)"""
+        raise NotImplementedError
+
+    async def latest_change(self, tenant: Optional[str]) -> int:
+        """Return the tenant's last allocated change sequence number"""
+        raise NotImplementedError
+
+    async def tail_changes(self):
+        """Yield change-log entries of every tenant as they are written"""
+        raise NotImplementedError
+        yield
+
+    async def startup(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+def _scoped(query, tenant):
+    return dict(query, tenant=tenant) if tenant else query
+
+
+class MongoRepository(Repository):
+    """Primary backend on the Motor collections from ``database.py``.
+
+    When ``snapshot_path`` is set, every write queues a re-export of the
+    writing tenant's rows of the SQLite snapshot on ``jobs``, so edge nodes
+    pick up the change. The whole snapshot is exported on startup.
+    """
+
+    has_change_log = True
+
+    def __init__(self, snapshot_path: Optional[str] = None, jobs: Optional[JobQueue] = None):
+        # Imported here so snapshot-only processes never create a Mongo client
+        import database
+        self.database = database
+        self.portfolio = database.portfolio_collection
+        self.services = database.services_collection
+        self.projects = database.projects_collection
+        self.changes = database.changes_collection
+        self.counters = database.counters_collection
+        self.snapshot_path = snapshot_path
+        self.jobs = jobs
+        # Tenants written since the last export started; None means all of them
+        self._export_tenants: Set[Optional[str]] = set()
+
+    async def startup(self):
+        """Create the tenant-scoped compound indexes the queries rely on"""
+        await self.portfolio.create_index([("tenant", ASCENDING)])
+        for collection in (self.services, self.projects):
+            await collection.create_index(
+                [("tenant", ASCENDING), ("active", ASCENDING), ("order", ASCENDING)]
+            )
+            await collection.create_index([("tenant", ASCENDING), ("id", ASCENDING)])
+        try:
+            await self.database.db.create_collection(
+                self.changes.name, capped=True, size=CHANGES_CAP_BYTES
+            )
+        except CollectionInvalid:
+            pass
+        await self.changes.create_index([("tenant", ASCENDING), ("seq", ASCENDING)])
+        # Catch up on writes made while no process was exporting, e.g. seed_data.py
+        self._written(None)
+
+    def _convert(self, document):
+        with span("convert"):
+            return self.database.convert_object_id(document)
+
+    async def _find_one(self, collection, tenant, query):
+        query = _scoped(query, tenant)
+        with query_span(self.database.db, {"find": collection.name, "filter": query, "limit": 1}):
+            document = await collection.find_one(query, TENANT_PROJECTION)
+        return self._convert(document)
+
+    async def _find_active(self, collection, tenant, keys=False):
+        query = _scoped({"active": True}, tenant)
+        command = {"find": collection.name, "filter": query, "sort": {"order": 1}, "limit": LIST_LIMIT}
+        with query_span(self.database.db, command):
+            cursor = collection.find(query, TENANT_PROJECTION).sort("order", 1)
+            documents = await cursor.to_list(LIST_LIMIT)
+        raw_ids = [document.get("id") for document in documents]
+        with span("convert"):
+            documents = self.database.convert_object_ids(documents)
+        return list(zip(raw_ids, documents)) if keys else documents
+
+    async def _insert(self, collection, tenant, document):
+        if tenant:
+            document["tenant"] = tenant
+        # insert_one sets _id on the dict, so there is no need to read it back
+        with query_span(self.database.db, None):
+            await collection.insert_one(document)
+        document.pop("tenant", None)
+        await self._record_change(tenant, collection, "create", document)
+        return self._convert(document)
+
+    async def _update(self, collection, tenant, query, update, op="update"):
+        if not update:
+            return await self._find_one(collection, tenant, query)
+        query = _scoped(query, tenant)
+        command = {"findAndModify": collection.name, "query": query, "update": update, "new": True}
+        try:
+            with query_span(self.database.db, command):
+                document = await collection.find_one_and_update(
+                    query, update,
+                    projection=TENANT_PROJECTION, return_document=ReturnDocument.AFTER
+                )
+        except OperationFailure as e:
+            if e.code in PATH_CONFLICT_CODES:
+                raise UpdateConflictError(e.details.get("errmsg", str(e)) if e.details else str(e))
+            raise
+        if document:
+            await self._record_change(tenant, collection, op, document, update)
+        return self._convert(document)
+
+    async def _record_change(self, tenant, collection, op, document, update=None):
+        """Append a write to the capped change log under the tenant's next sequence number"""
+        query, increment = {"_id": f"changes:{tenant or ''}"}, {"$inc": {"seq": 1}}
+        command = {"findAndModify": self.counters.name, "query": query, "update": increment,
+                   "upsert": True, "new": True}
+        with query_span(self.database.db, command, "changelog"):
+            counter = await self.counters.find_one_and_update(
+                query, increment, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        entry = {
+            "tenant": tenant,
+            "seq": counter["seq"],
+            "collection": collection.name,
+            "op": op,
+            "id": str(document["_id"]),
+            "ts": datetime.utcnow(),
+        }
+        if update:
+            entry["fields"] = sorted({path.split(".")[0] for paths in update.values() for path in paths})
+        with query_span(self.database.db, None, "changelog"):
+            await self.changes.insert_one(entry)
+        self._written(tenant)
+        return entry
+
+    async def list_changes(self, tenant, since, limit):
+        """Return the tenant's change-log entries with ``seq > since``.
+
+        ``reset`` is set when entries after ``since`` have already rolled out of
+        the capped log, in which case the client must refetch everything and
+        continue from ``next``. Results stop at a sequence hole younger than
+        ``CHANGE_GAP_GRACE`` so a slow concurrent writer is not skipped;
+        ``pending`` is then set and the rest should be asked for shortly.
+        """
+        latest = await self.latest_change(tenant)
+        if since >= latest:
+            return {"changes": [], "next": latest, "reset": since > latest, "pending": False}
+
+        command = {"find": self.changes.name, "filter": {"tenant": tenant}, "sort": {"seq": 1}, "limit": 1}
+        with query_span(self.database.db, command):
+            oldest = await self.changes.find_one({"tenant": tenant}, {"seq": 1}, sort=[("seq", ASCENDING)])
+        if oldest is None or oldest["seq"] > since + 1:
+            return {"changes": [], "next": latest, "reset": True, "pending": False}
+
+        query = {"tenant": tenant, "seq": {"$gt": since}}
+        command = {"find": self.changes.name, "filter": query, "sort": {"seq": 1}, "limit": limit}
+        with query_span(self.database.db, command):
+            cursor = self.changes.find(query, {"_id": 0, "tenant": 0}).sort("seq", ASCENDING).limit(limit)
+            entries = await cursor.to_list(limit)
+        changes = []
+        expected = since + 1
+        horizon = datetime.utcnow() - CHANGE_GAP_GRACE
+        pending = False
+        for entry in entries:
+            if entry["seq"] != expected and entry["ts"] > horizon:
+                pending = True
+                break
+            changes.append(entry)
+            expected = entry["seq"] + 1
+        return {"changes": changes, "next": expected - 1, "reset": False, "pending": pending}
+
+    async def latest_change(self, tenant):
+        query = {"_id": f"changes:{tenant or ''}"}
+        with query_span(self.database.db, {"find": self.counters.name, "filter": query, "limit": 1}):
+            counter = await self.counters.find_one(query)
+        return counter["seq"] if counter else 0
+
+    async def tail_changes(self):
+        """Follow the capped change log with a tailable cursor.
+
+        Tailing the collection rather than hooking local writes means every
+        process sees the writes made by all of them. A tailable cursor
+        returns entries in insertion order, but ``_id``s are generated by
+        each writer process and do not follow it, so a reopened cursor
+        cannot resume after the last ``_id``. It re-reads the entries within
+        ``CHANGE_TAIL_WINDOW`` of the newest ``ts`` seen instead and skips
+        those already yielded.
+        """
+        seen: Dict[Any, datetime] = {}
+        newest = None
+        latest = await self.changes.find_one({}, {"ts": 1}, sort=[("$natural", -1)])
+        if latest:
+            newest = latest["ts"]
+            async for entry in self.changes.find({"ts": {"$gte": newest - CHANGE_TAIL_WINDOW}}, {"ts": 1}):
+                seen[entry["_id"]] = entry["ts"]
+                newest = max(newest, entry["ts"])
+        prune_at = len(seen) + 1000
+
+        def prune():
+            horizon = newest - CHANGE_TAIL_WINDOW
+            return {key: ts for key, ts in seen.items() if ts >= horizon}
+
+        while True:
+            query = {"ts": {"$gte": newest - CHANGE_TAIL_WINDOW}} if newest else {}
+            cursor = self.changes.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            while cursor.alive:
+                async for entry in cursor:
+                    if entry["_id"] in seen:
+                        continue
+                    seen[entry["_id"]] = entry["ts"]
+                    newest = entry["ts"] if newest is None else max(newest, entry["ts"])
+                    if len(seen) >= prune_at:
+                        seen = prune()
+                        prune_at = len(seen) * 2 + 1000
+                    yield entry
+            # The cursor dies when the log is empty or rolls over; reopen it
+            if seen:
+                seen = prune()
+            await asyncio.sleep(CHANGE_TAIL_RETRY_SECONDS)
+
+    async def get_portfolio(self, tenant):
+        return await self._find_one(self.portfolio, tenant, {})
+
+    async def update_portfolio(self, tenant, update):
+        return await self._update(self.portfolio, tenant, {}, update)
+
+    async def list_services(self, tenant):
+        return await self._find_active(self.services, tenant)
+
+    async def create_service(self, tenant, document):
+        return await self._insert(self.services, tenant, document)
+
+    async def update_service(self, tenant, service_id, update):
+        return await self._update(self.services, tenant, {"id": service_id}, update)
+
+    async def delete_service(self, tenant, service_id):
+        return await self._update(
+            self.services, tenant, {"id": service_id}, {"$set": {"active": False}}, op="delete"
+        )
+
+    async def list_projects(self, tenant):
+        return await self._find_active(self.projects, tenant)
+
+    async def list_projects_by_key(self, tenant):
+        return await self._find_active(self.projects, tenant, keys=True)
+
+    async def get_project(self, tenant, project_id):
+        return await self._find_one(self.projects, tenant, {"id": project_id, "active": True})
+
+    async def create_project(self, tenant, document):
+        return await self._insert(self.projects, tenant, document)
+
+    async def update_project(self, tenant, project_id, update):
+        return await self._update(self.projects, tenant, {"id": project_id}, update)
+
+    async def delete_project(self, tenant, project_id):
+        return await self._update(
+            self.projects, tenant, {"id": project_id}, {"$set": {"active": False}}, op="delete"
+        )
+
+    def _written(self, tenant):
+        """Queue a snapshot export of ``tenant``; writes made before it starts share one export"""
+        if self.snapshot_path and self.jobs:
+            self._export_tenants.add(tenant)
+            self.jobs.submit(("export-snapshot", self.snapshot_path), self._export_snapshot)
+
+    async def _export_snapshot(self):
+        tenants, self._export_tenants = self._export_tenants, set()
+        try:
+            # Single-tenant writes (tenant None) cover every document
+            await export_snapshot(self, self.snapshot_path, None if None in tenants else sorted(tenants))
+        except Exception:
+            # The queue retries the job, which picks these up again
+            self._export_tenants |= tenants
+            raise
+
+    async def close(self):
+        await self.database.close_db_client()
+
+
+SNAPSHOT_SCHEMA = """
+CREATE TABLE documents (
+    collection TEXT NOT NULL,
+    tenant TEXT,
+    doc_key TEXT,
+    position INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX documents_lookup ON documents (collection, tenant, doc_key);
+CREATE INDEX documents_order ON documents (collection, tenant, position);
+"""
+
+
+def json_default(value):
+    """``json.dumps`` fallback matching how the API serializes stored documents"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def public_document(document) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Split a raw document into its tenant and the body the API returns for it.
+
+    Matches ``TENANT_PROJECTION`` plus ``convert_object_id``; every snapshot
+    format goes through here so they cannot drift from the live endpoints.
+    """
+    body = dict(document)
+    tenant = body.pop("tenant", None)
+    if "_id" in body:
+        body["id"] = str(body.pop("_id"))
+    return tenant, body
+
+
+def write_snapshot(path, portfolios, services, projects, tenants: Optional[List[str]] = None):
+    """Atomically write a snapshot file from already-read raw documents.
+
+    Only what the public read endpoints can return is stored: the portfolios
+    and active services/projects of every tenant, in ``order``. Bodies are
+    stored converted and pre-encoded; ``doc_key`` keeps the raw ``id`` field
+    used for lookups. With ``tenants`` the documents are only those tenants'
+    and replace their rows in a copy of the existing file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    os.close(fd)
+    try:
+        if tenants is not None:
+            shutil.copyfile(path, tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            if tenants is None:
+                conn.executescript(SNAPSHOT_SCHEMA)
+            else:
+                placeholders = ", ".join("?" * len(tenants))
+                conn.execute(f"DELETE FROM documents WHERE tenant IN ({placeholders})", tenants)
+            rows = []
+            for collection, documents in (
+                ("portfolio", portfolios),
+                ("services", services),
+                ("projects", projects),
+            ):
+                for position, document in enumerate(documents):
+                    tenant, body = public_document(document)
+                    rows.append((collection, tenant, document.get("id"), position,
+                                 json.dumps(body, default=json_default)))
+            conn.executemany("INSERT INTO documents VALUES (?, ?, ?, ?, ?)", rows)
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+async def read_public_dataset(repository: MongoRepository, tenants: Optional[List[str]] = None):
+    """Raw portfolios and active services/projects, in ``order``, of every
+    tenant or only of ``tenants``"""
+    db = repository.database.db
+    scope = {"tenant": {"$in": tenants}} if tenants is not None else {}
+    active = {"active": True, **scope}
+    with query_span(db, {"find": repository.portfolio.name, "filter": scope}):
+        portfolios = await repository.portfolio.find(scope).to_list(None)
+    with query_span(db, {"find": repository.services.name, "filter": active, "sort": {"order": 1}}):
+        services = await repository.services.find(active).sort("order", 1).to_list(None)
+    with query_span(db, {"find": repository.projects.name, "filter": active, "sort": {"order": 1}}):
+        projects = await repository.projects.find(active).sort("order", 1).to_list(None)
+    return portfolios, services, projects
+
+
+async def export_snapshot(repository: MongoRepository, path, tenants: Optional[List[str]] = None):
+    """Read the public dataset from Mongo and write it to a snapshot file.
+
+    With ``tenants`` only their rows are re-read and replaced. Exports hold
+    an exclusive lock on ``<path>.lock`` from read to rename, so workers
+    exporting different tenants apply their changes one after another
+    instead of overwriting each other's.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+        if tenants is not None and not os.path.exists(path):
+            tenants = None
+        dataset = await read_public_dataset(repository, tenants)
+        await asyncio.to_thread(write_snapshot, path, *dataset, tenants=tenants)
+
+
+def pull_snapshot(url: str, path, token: Optional[str] = None, etag: Optional[str] = None) -> Optional[str]:
+    """Download the snapshot at ``url`` over ``path`` unless it still has ``etag``.
+
+    Returns the ETag of the snapshot now at ``path``. The download is checked
+    to be a readable snapshot before it atomically replaces the file.
+    """
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    if etag:
+        headers["If-None-Match"] = etag
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with requests.get(url, headers=headers, timeout=30, stream=True) as response:
+        if response.status_code == 304:
+            return etag
+        response.raise_for_status()
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(64 * 1024):
+                    f.write(chunk)
+            conn = sqlite3.connect(f"file:{tmp_path}?mode=ro", uri=True)
+            try:
+                conn.execute("SELECT count(*) FROM documents").fetchone()
+            finally:
+                conn.close()
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return response.headers.get("etag")
+
+
+class SnapshotRepository(Repository):
+    """Read-only backend serving from a local SQLite snapshot file.
+
+    Snapshots are replaced atomically, so the connection is reopened whenever
+    the file's inode or mtime changes. Queries hit a small local index and
+    run inline; a thread hop would cost more than the read itself.
+
+    With ``source_url`` the file is kept current by polling a primary's
+    ``/api/ops/snapshot`` every ``pull_seconds``; otherwise something else
+    (a shared volume, a sync job) must replace it.
+    """
+    read_only = True
+
+    def __init__(self, path, source_url: Optional[str] = None, source_token: Optional[str] = None,
+                 pull_seconds: float = SNAPSHOT_PULL_SECONDS):
+        self.path = str(path)
+        self.source_url = source_url
+        self.source_token = source_token
+        self.pull_seconds = pull_seconds
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stamp = None
+        self._pull_task: Optional[asyncio.Task] = None
+
+    async def startup(self):
+        if self.source_url:
+            self._pull_task = asyncio.create_task(self._pull())
+
+    async def _pull(self):
+        etag = None
+        while True:
+            try:
+                etag = await asyncio.to_thread(pull_snapshot, self.source_url, self.path, self.source_token, etag)
+            except Exception as e:
+                logging.error(f"Error pulling snapshot from {self.source_url}: {str(e)}")
+            await asyncio.sleep(self.pull_seconds)
+
+    def _connection(self) -> sqlite3.Connection:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # Keep serving the file already open; an unlinked file stays readable
+            if self._conn is None:
+                raise SnapshotUnavailableError(f"Snapshot {self.path} does not exist yet")
+            return self._conn
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if stamp != self._stamp:
+            if self._conn:
+                self._conn.close()
+            self._conn = sqlite3.connect(
+                f"file:{self.path}?mode=ro", uri=True, check_same_thread=False
+            )
+            self._stamp = stamp
+        return self._conn
+
+    def _rows(self, collection, tenant, where="", params=(), limit=LIST_LIMIT, keys=False):
+        sql = "SELECT doc_key, body FROM documents WHERE collection = ?"
+        args = [collection]
+        if tenant:
+            sql += " AND tenant = ?"
+            args.append(tenant)
+        sql += f"{where} ORDER BY position LIMIT ?"
+        args.extend(params)
+        args.append(limit)
+        rows = self._connection().execute(sql, args)
+        if keys:
+            return [(key, json.loads(body)) for key, body in rows]
+        return [json.loads(body) for _, body in rows]
+
+    async def get_portfolio(self, tenant):
+        rows = self._rows("portfolio", tenant, limit=1)
+        return rows[0] if rows else None
+
+    async def list_services(self, tenant):
+        return self._rows("services", tenant)
+
+    async def list_projects(self, tenant):
+        return self._rows("projects", tenant)
+
+    async def list_projects_by_key(self, tenant):
+        return self._rows("projects", tenant, keys=True)
+
+    async def get_project(self, tenant, project_id):
+        rows = self._rows("projects", tenant, " AND doc_key = ?", (project_id,), limit=1)
+        return rows[0] if rows else None
+
+    async def _read_only(self, *args, **kwargs):
+        raise ReadOnlyRepositoryError("Storage backend is read-only")
+
+    update_portfolio = create_service = update_service = delete_service = _read_only
+    create_project = update_project = delete_project = _read_only
+
+    async def close(self):
+        if self._pull_task:
+            self._pull_task.cancel()
+            await asyncio.gather(self._pull_task, return_exceptions=True)
+            self._pull_task = None
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+
+class CachedRepository(Repository):
+    """Serves repeated reads from a per-tenant ``TenantCache``.
+
+    Writes go to the wrapped backend and drop the writing tenant's entries,
+    so a tenant's edits never touch another tenant's cache. With ``jobs``
+    the tenant's list payloads are then reloaded in the background, so the
+    next visitor does not pay for the miss.
+    """
+
+    def __init__(self, inner: Repository, cache: TenantCache, jobs: Optional[JobQueue] = None):
+        self.inner = inner
+        self.cache = cache
+        self.jobs = jobs
+        self.read_only = inner.read_only
+        self.has_change_log = inner.has_change_log
+
+    async def _cached(self, tenant, key, load):
+        value = self.cache.get(tenant, key)
+        if value is None:
+            value = await load()
+            if value is not None:
+                self.cache.put(tenant, key, value)
+        return value
+
+    async def _write(self, tenant, result):
+        self.cache.invalidate(tenant)
+        if self.jobs:
+            self.jobs.submit(("warm-cache", tenant), self._warm, tenant)
+        return result
+
+    async def _warm(self, tenant):
+        await self.get_portfolio(tenant)
+        await self.list_services(tenant)
+        await self.list_projects(tenant)
+
+    async def get_portfolio(self, tenant):
+        return await self._cached(tenant, "portfolio", lambda: self.inner.get_portfolio(tenant))
+
+    async def update_portfolio(self, tenant, update):
+        return await self._write(tenant, await self.inner.update_portfolio(tenant, update))
+
+    async def list_services(self, tenant):
+        return await self._cached(tenant, "services", lambda: self.inner.list_services(tenant))
+
+    async def create_service(self, tenant, document):
+        return await self._write(tenant, await self.inner.create_service(tenant, document))
+
+    async def update_service(self, tenant, service_id, update):
+        return await self._write(tenant, await self.inner.update_service(tenant, service_id, update))
+
+    async def delete_service(self, tenant, service_id):
+        return await self._write(tenant, await self.inner.delete_service(tenant, service_id))
+
+    async def list_projects(self, tenant):
+        return await self._cached(tenant, "projects", lambda: self.inner.list_projects(tenant))
+
+    async def list_projects_by_key(self, tenant):
+        return await self._cached(tenant, "projects-by-key", lambda: self.inner.list_projects_by_key(tenant))
+
+    async def get_project(self, tenant, project_id):
+        return await self._cached(
+            tenant, ("project", project_id), lambda: self.inner.get_project(tenant, project_id)
+        )
+
+    async def create_project(self, tenant, document):
+        return await self._write(tenant, await self.inner.create_project(tenant, document))
+
+    async def update_project(self, tenant, project_id, update):
+        return await self._write(tenant, await self.inner.update_project(tenant, project_id, update))
+
+    async def delete_project(self, tenant, project_id):
+        return await self._write(tenant, await self.inner.delete_project(tenant, project_id))
+
+    async def list_changes(self, tenant, since, limit):
+        return await self.inner.list_changes(tenant, since, limit)
+
+    async def latest_change(self, tenant):
+        return await self.inner.latest_change(tenant)
+
+    def tail_changes(self):
+        return self.inner.tail_changes()
+
+    async def startup(self):
+        await self.inner.startup()
+
+    async def close(self):
+        await self.inner.close()
+
+
+def create_repository(jobs: Optional[JobQueue] = None) -> Repository:
+    """Build the backend selected by STORAGE_BACKEND (``mongo`` or ``snapshot``).
+
+    Reads are cached per tenant unless CACHE_TTL is 0. Post-write work
+    (snapshot export, cache warming) runs on ``jobs`` when given.
+    """
+    backend = os.environ.get('STORAGE_BACKEND', 'mongo')
+    snapshot_path = os.environ.get('SNAPSHOT_PATH')
+    if backend == 'mongo':
+        repository = MongoRepository(snapshot_path=snapshot_path, jobs=jobs)
+    elif backend == 'snapshot':
+        if not snapshot_path:
+            raise RuntimeError("STORAGE_BACKEND=snapshot requires SNAPSHOT_PATH")
+        repository = SnapshotRepository(
+            snapshot_path,
+            source_url=os.environ.get('SNAPSHOT_SOURCE_URL'),
+            source_token=os.environ.get('SNAPSHOT_SOURCE_TOKEN'),
+        )
+    else:
+        raise RuntimeError(f"Unknown STORAGE_BACKEND '{backend}'")
+
+    ttl = float(os.environ.get('CACHE_TTL', '5'))
+    if ttl <= 0:
+        return repository
+    return CachedRepository(repository, TenantCache(
+        tenant_bytes=int(os.environ.get('CACHE_TENANT_BYTES', 1024 * 1024)),
+        total_bytes=int(os.environ.get('CACHE_TOTAL_BYTES', 64 * 1024 * 1024)),
+        ttl=ttl,
+    ), jobs=jobs)
+
+
+async def main(path):
+    repository = MongoRepository()
+    try:
+        await export_snapshot(repository, path)
+        print(f"Snapshot written to {path}")
+    finally:
+        await repository.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else os.environ['SNAPSHOT_PATH']))
@@ -1,14 +1,20 @@
 from database import portfolio_collection, services_collection, projects_collection
 from models import Portfolio, PersonalInfo, AboutInfo, Experience, NavigationItem, Service, Project
+from tenancy import TENANT_MODE
 import asyncio
+import sys
 
-async def seed_database():
-    """Seed database with initial portfolio data"""
+async def seed_database(tenant=None):
+    """Seed database with initial portfolio data (optionally for one tenant)"""
+    if not tenant and TENANT_MODE != "single":
+        # An unscoped clear would wipe every tenant's data
+        raise SystemExit(f"TENANT_MODE is '{TENANT_MODE}': pass the tenant to seed, e.g. python seed_data.py <tenant>")
+    scope = {"tenant": tenant} if tenant else {}
     
     # Clear existing data
-    await portfolio_collection.delete_many({})
-    await services_collection.delete_many({})
-    await projects_collection.delete_many({})
+    await portfolio_collection.delete_many(scope)
+    await services_collection.delete_many(scope)
+    await projects_collection.delete_many(scope)
     
     # Seed portfolio data
     portfolio_data = Portfolio(
@@ -40,7 +46,7 @@ async def seed_database():
         ]
     )
     
-    await portfolio_collection.insert_one(portfolio_data.dict())
+    await portfolio_collection.insert_one({**portfolio_data.dict(), **scope})
     
     # Seed services data
     services_data = [
@@ -71,7 +77,7 @@ async def seed_database():
     ]
     
     for service in services_data:
-        await services_collection.insert_one(service.dict())
+        await services_collection.insert_one({**service.dict(), **scope})
     
     # Seed projects data with images
     projects_data = [
@@ -204,9 +210,9 @@ async def seed_database():
     ]
     
     for project in projects_data:
-        await projects_collection.insert_one(project.dict())
+        await projects_collection.insert_one({**project.dict(), **scope})
     
     print("Database seeded successfully with project images!")
 
 if __name__ == "__main__":
-    asyncio.run(seed_database())
\ No newline at end of file
+    asyncio.run(seed_database(sys.argv[1] if len(sys.argv) > 1 else None))
\ No newline at end of file
@@ -1,219 +1,479 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
+import hmac
+import asyncio
 import logging
+import threading
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
-# Import our models and database
+# Import our models and storage layer
 from models import (
-    Portfolio, PortfolioUpdate, 
+    Portfolio, PortfolioUpdate,
     Service, ServiceCreate, ServiceUpdate,
     Project, ProjectCreate, ProjectUpdate
 )
-from database import (
-    portfolio_collection, services_collection, projects_collection,
-    convert_object_id, convert_object_ids, close_db_client
+from repository import (
+    create_repository, ReadOnlyRepositoryError, SnapshotUnavailableError, UpdateConflictError
+)
+from tenancy import TenantMiddleware, get_tenant
+from events import EventBroker
+from jobs import JobQueue
+from tracing import TracedRoute, TracingMiddleware, RequestIdFilter
+from images import IMAGE_WORKERS, describe_project_images
+from related import RelatedProjects
+from payloads import PAYLOAD_SNAPSHOT_PATH, PayloadSnapshot, PayloadRefresher
+from patch import (
+    PatchError, JSON_PATCH_CONTENT_TYPE,
+    merge_patch_to_update, json_patch_to_update
 )
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Background worker for post-write side work (snapshot export, cache warming)
+jobs = JobQueue()
+
+# Image fetching waits on client-chosen hosts, so it gets its own workers and
+# can never hold up the post-write work above
+image_jobs = JobQueue(workers=IMAGE_WORKERS)
+# Set on shutdown so downloads still running in threads give up
+stop_image_downloads = threading.Event()
+
+# Storage backend (Mongo, or a read-only snapshot on edge nodes)
+repository = create_repository(jobs)
+
+# Precomputed "related projects" tables, one per tenant
+related_projects = RelatedProjects(repository)
+
+# Pushes change-log entries to /api/events subscribers
+broker = EventBroker()
+
+# Pre-encoded read responses shared by all workers through a mapped file
+payloads = PayloadSnapshot(PAYLOAD_SNAPSHOT_PATH) if PAYLOAD_SNAPSHOT_PATH else None
+payload_refresher = PayloadRefresher(PAYLOAD_SNAPSHOT_PATH) if PAYLOAD_SNAPSHOT_PATH else None
+
 # Create the main app without a prefix
 app = FastAPI(title="Designer Portfolio API")
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TracedRoute)
+
+@app.exception_handler(ReadOnlyRepositoryError)
+async def read_only_handler(request: Request, exc: ReadOnlyRepositoryError):
+    return JSONResponse(status_code=405, content={"detail": str(exc)})
+
+@app.exception_handler(SnapshotUnavailableError)
+async def snapshot_unavailable_handler(request: Request, exc: SnapshotUnavailableError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(UpdateConflictError)
+async def update_conflict_handler(request: Request, exc: UpdateConflictError):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+async def read_patch(request: Request, model, writable):
+    """Compile a merge patch or JSON Patch request body into a Mongo update"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Patch body must be valid JSON")
+    try:
+        if content_type == JSON_PATCH_CONTENT_TYPE or isinstance(body, list):
+            return json_patch_to_update(body, model, writable)
+        return merge_patch_to_update(body, model, writable)
+    except PatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+IMAGE_FIELDS = {"thumbnail_image", "static_images", "carousel_images"}
+
+async def refresh_project_images(tenant, project_id):
+    """Recompute image metadata for a project; unchanged URLs are not refetched"""
+    project = await repository.get_project(tenant, project_id)
+    if not project:
+        return
+    images = await asyncio.to_thread(describe_project_images, project, False, False, stop_image_downloads)
+    if images is not None:
+        await repository.update_project(tenant, project_id, {"$set": {"images": images}})
+
+def shared_payload(tenant, key):
+    """Response from the shared payload snapshot, or None to read the repository"""
+    return payloads.response(tenant, key) if payloads else None
+
+def written(tenant):
+    """Keep this worker's reads of ``tenant`` off the payload snapshot until it catches up"""
+    if payloads:
+        payloads.mark_written(tenant)
+
+def after_project_write(tenant, project_id, update):
+    """Queue the derived work a project write invalidates"""
+    written(tenant)
+    jobs.submit(("related-projects", tenant), related_projects.refresh, tenant)
+    fields = {path.split(".")[0] for paths in update.values() for path in paths}
+    if fields & IMAGE_FIELDS:
+        image_jobs.submit(("project-images", tenant, project_id), refresh_project_images, tenant, project_id)
 
 # Portfolio endpoints
 @api_router.get("/portfolio")
-async def get_portfolio():
+async def get_portfolio(tenant: Optional[str] = Depends(get_tenant)):
     """Get portfolio information (personal + about + navigation)"""
     try:
-        portfolio_data = await portfolio_collection.find_one()
+        shared = shared_payload(tenant, "portfolio")
+        if shared is not None:
+            return shared
+
+        portfolio_data = await repository.get_portfolio(tenant)
         if not portfolio_data:
             raise HTTPException(status_code=404, detail="Portfolio not found")
-        
-        portfolio_data = convert_object_id(portfolio_data)
+
         return {"success": True, "data": portfolio_data}
+    except (HTTPException, SnapshotUnavailableError):
+        raise
     except Exception as e:
         logging.error(f"Error fetching portfolio: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @api_router.put("/portfolio")
-async def update_portfolio(portfolio_update: PortfolioUpdate):
+async def update_portfolio(portfolio_update: PortfolioUpdate, tenant: Optional[str] = Depends(get_tenant)):
     """Update portfolio information"""
     try:
         update_data = {k: v for k, v in portfolio_update.dict().items() if v is not None}
-        
-        result = await portfolio_collection.update_one(
-            {}, 
-            {"$set": update_data}
+
+        updated_portfolio = await repository.update_portfolio(
+            tenant,
+            {"$set": update_data} if update_data else {}
         )
-        
-        if result.matched_count == 0:
+
+        if not updated_portfolio:
             raise HTTPException(status_code=404, detail="Portfolio not found")
-            
-        updated_portfolio = await portfolio_collection.find_one()
-        updated_portfolio = convert_object_id(updated_portfolio)
-        
+
+        written(tenant)
         return {"success": True, "data": updated_portfolio}
+    except (HTTPException, ReadOnlyRepositoryError):
+        raise
     except Exception as e:
         logging.error(f"Error updating portfolio: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@api_router.patch("/portfolio")
+async def patch_portfolio(request: Request, tenant: Optional[str] = Depends(get_tenant)):
+    """Partially update portfolio information (merge patch or JSON Patch)"""
+    try:
+        update = await read_patch(request, Portfolio, PortfolioUpdate.model_fields)
+        patched = await repository.update_portfolio(tenant, update)
+
+        if not patched:
+            raise HTTPException(status_code=404, detail="Portfolio not found")
+
+        written(tenant)
+        return {"success": True, "data": patched}
+    except (HTTPException, ReadOnlyRepositoryError, UpdateConflictError):
+        raise
+    except Exception as e:
+        logging.error(f"Error patching portfolio: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 # Services endpoints
 @api_router.get("/services")
-async def get_services():
+async def get_services(tenant: Optional[str] = Depends(get_tenant)):
     """Get all active services ordered by order field"""
     try:
-        services_cursor = services_collection.find({"active": True}).sort("order", 1)
-        services = await services_cursor.to_list(100)
-        services = convert_object_ids(services)
-        
+        shared = shared_payload(tenant, "services")
+        if shared is not None:
+            return shared
+
+        services = await repository.list_services(tenant)
+
         return {"success": True, "data": services}
+    except SnapshotUnavailableError:
+        raise
     except Exception as e:
         logging.error(f"Error fetching services: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @api_router.post("/services")
-async def create_service(service_data: ServiceCreate):
+async def create_service(service_data: ServiceCreate, tenant: Optional[str] = Depends(get_tenant)):
     """Create new service"""
     try:
         service = Service(**service_data.dict())
-        result = await services_collection.insert_one(service.dict())
-        
-        created_service = await services_collection.find_one({"_id": result.inserted_id})
-        created_service = convert_object_id(created_service)
-        
+        created_service = await repository.create_service(tenant, service.dict())
+        written(tenant)
+
         return {"success": True, "data": created_service}
+    except ReadOnlyRepositoryError:
+        raise
     except Exception as e:
         logging.error(f"Error creating service: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @api_router.put("/services/{service_id}")
-async def update_service(service_id: str, service_update: ServiceUpdate):
+async def update_service(service_id: str, service_update: ServiceUpdate, tenant: Optional[str] = Depends(get_tenant)):
     """Update service"""
     try:
         update_data = {k: v for k, v in service_update.dict().items() if v is not None}
-        
-        result = await services_collection.update_one(
-            {"id": service_id},
-            {"$set": update_data}
+
+        updated_service = await repository.update_service(
+            tenant,
+            service_id,
+            {"$set": update_data} if update_data else {}
         )
-        
-        if result.matched_count == 0:
+
+        if not updated_service:
             raise HTTPException(status_code=404, detail="Service not found")
-            
-        updated_service = await services_collection.find_one({"id": service_id})
-        updated_service = convert_object_id(updated_service)
-        
+
+        written(tenant)
         return {"success": True, "data": updated_service}
+    except (HTTPException, ReadOnlyRepositoryError):
+        raise
     except Exception as e:
         logging.error(f"Error updating service: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@api_router.patch("/services/{service_id}")
+async def patch_service(service_id: str, request: Request, tenant: Optional[str] = Depends(get_tenant)):
+    """Partially update service (merge patch or JSON Patch)"""
+    try:
+        update = await read_patch(request, Service, ServiceUpdate.model_fields)
+        patched = await repository.update_service(tenant, service_id, update)
+
+        if not patched:
+            raise HTTPException(status_code=404, detail="Service not found")
+
+        written(tenant)
+        return {"success": True, "data": patched}
+    except (HTTPException, ReadOnlyRepositoryError, UpdateConflictError):
+        raise
+    except Exception as e:
+        logging.error(f"Error patching service: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @api_router.delete("/services/{service_id}")
-async def delete_service(service_id: str):
+async def delete_service(service_id: str, tenant: Optional[str] = Depends(get_tenant)):
     """Delete service (soft delete by setting active=False)"""
     try:
-        result = await services_collection.update_one(
-            {"id": service_id},
-            {"$set": {"active": False}}
-        )
-        
-        if result.matched_count == 0:
+        deleted_service = await repository.delete_service(tenant, service_id)
+
+        if not deleted_service:
             raise HTTPException(status_code=404, detail="Service not found")
-            
+
+        written(tenant)
         return {"success": True, "message": "Service deleted successfully"}
+    except (HTTPException, ReadOnlyRepositoryError):
+        raise
     except Exception as e:
         logging.error(f"Error deleting service: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 # Projects endpoints
 @api_router.get("/projects")
-async def get_projects():
+async def get_projects(tenant: Optional[str] = Depends(get_tenant)):
     """Get all active projects ordered by order field (for home page)"""
     try:
-        projects_cursor = projects_collection.find({"active": True}).sort("order", 1)
-        projects = await projects_cursor.to_list(100)
-        projects = convert_object_ids(projects)
-        
+        shared = shared_payload(tenant, "projects")
+        if shared is not None:
+            return shared
+
+        projects = await repository.list_projects(tenant)
+
         return {"success": True, "data": projects}
+    except SnapshotUnavailableError:
+        raise
     except Exception as e:
         logging.error(f"Error fetching projects: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @api_router.get("/projects/{project_id}")
-async def get_project_detail(project_id: str):
+async def get_project_detail(project_id: str, tenant: Optional[str] = Depends(get_tenant)):
     """Get individual project details by ID"""
     try:
-        project = await projects_collection.find_one({"id": project_id, "active": True})
-        
+        shared = shared_payload(tenant, f"project:{project_id}")
+        if shared is not None:
+            return shared
+
+        project = await repository.get_project(tenant, project_id)
+
         if not project:
             raise HTTPException(status_code=404, detail="Project not found")
-            
-        project = convert_object_id(project)
+
         return {"success": True, "data": project}
+    except (HTTPException, SnapshotUnavailableError):
+        raise
     except Exception as e:
         logging.error(f"Error fetching project detail: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@api_router.get("/projects/{project_id}/related")
+async def get_related_projects(project_id: str, limit: int = 4, tenant: Optional[str] = Depends(get_tenant)):
+    """Get the active projects most similar to a project (categories, client, year)"""
+    try:
+        related = await related_projects.related(tenant, project_id, min(max(limit, 1), 8))
+
+        if related is None:
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        return {"success": True, "data": related}
+    except (HTTPException, SnapshotUnavailableError):
+        raise
+    except Exception as e:
+        logging.error(f"Error fetching related projects: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @api_router.post("/projects")
-async def create_project(project_data: ProjectCreate):
+async def create_project(project_data: ProjectCreate, tenant: Optional[str] = Depends(get_tenant)):
     """Create new project"""
     try:
         project = Project(**project_data.dict())
-        result = await projects_collection.insert_one(project.dict())
-        
-        created_project = await projects_collection.find_one({"_id": result.inserted_id})
-        created_project = convert_object_id(created_project)
-        
+        created_project = await repository.create_project(tenant, project.dict())
+        after_project_write(tenant, project.id, {"$set": project_data.dict()})
+
         return {"success": True, "data": created_project}
+    except ReadOnlyRepositoryError:
+        raise
     except Exception as e:
         logging.error(f"Error creating project: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @api_router.put("/projects/{project_id}")
-async def update_project(project_id: str, project_update: ProjectUpdate):
+async def update_project(project_id: str, project_update: ProjectUpdate, tenant: Optional[str] = Depends(get_tenant)):
     """Update project"""
     try:
         update_data = {k: v for k, v in project_update.dict().items() if v is not None}
-        
-        result = await projects_collection.update_one(
-            {"id": project_id},
-            {"$set": update_data}
+
+        updated_project = await repository.update_project(
+            tenant,
+            project_id,
+            {"$set": update_data} if update_data else {}
         )
-        
-        if result.matched_count == 0:
+
+        if not updated_project:
             raise HTTPException(status_code=404, detail="Project not found")
-            
-        updated_project = await projects_collection.find_one({"id": project_id})
-        updated_project = convert_object_id(updated_project)
-        
+
+        after_project_write(tenant, project_id, {"$set": update_data})
+
         return {"success": True, "data": updated_project}
+    except (HTTPException, ReadOnlyRepositoryError):
+        raise
     except Exception as e:
         logging.error(f"Error updating project: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@api_router.patch("/projects/{project_id}")
+async def patch_project(project_id: str, request: Request, tenant: Optional[str] = Depends(get_tenant)):
+    """Partially update project (merge patch or JSON Patch)"""
+    try:
+        update = await read_patch(request, Project, ProjectUpdate.model_fields)
+        patched = await repository.update_project(tenant, project_id, update)
+
+        if not patched:
+            raise HTTPException(status_code=404, detail="Project not found")
+
+        after_project_write(tenant, project_id, update)
+
+        return {"success": True, "data": patched}
+    except (HTTPException, ReadOnlyRepositoryError, UpdateConflictError):
+        raise
+    except Exception as e:
+        logging.error(f"Error patching project: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @api_router.delete("/projects/{project_id}")
-async def delete_project(project_id: str):
+async def delete_project(project_id: str, tenant: Optional[str] = Depends(get_tenant)):
     """Delete project (soft delete by setting active=False)"""
     try:
-        result = await projects_collection.update_one(
-            {"id": project_id},
-            {"$set": {"active": False}}
-        )
-        
-        if result.matched_count == 0:
+        deleted_project = await repository.delete_project(tenant, project_id)
+
+        if not deleted_project:
             raise HTTPException(status_code=404, detail="Project not found")
-            
+
+        after_project_write(tenant, project_id, {})
+
         return {"success": True, "message": "Project deleted successfully"}
+    except (HTTPException, ReadOnlyRepositoryError):
+        raise
     except Exception as e:
         logging.error(f"Error deleting project: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+# Change log endpoint
+@api_router.get("/changes")
+async def get_changes(since: int = 0, limit: int = 100, tenant: Optional[str] = Depends(get_tenant)):
+    """Get writes made after sequence number `since` (incremental sync)"""
+    try:
+        changes = await repository.list_changes(tenant, since, min(max(limit, 1), 1000))
+
+        return {"success": True, "data": changes}
+    except NotImplementedError:
+        raise HTTPException(status_code=501, detail="Change log is not available on this backend")
+    except Exception as e:
+        logging.error(f"Error fetching changes: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@api_router.get("/events")
+async def get_events(request: Request, last_event_id: Optional[str] = None,
+                     tenant: Optional[str] = Depends(get_tenant)):
+    """Stream change notifications as Server-Sent Events.
+
+    Browsers send ``Last-Event-ID`` when they reconnect; clients opening a
+    new stream can pass it as ``?last_event_id=`` instead.
+    """
+    if not broker.running:
+        raise HTTPException(status_code=501, detail="Live events are not available on this backend")
+    if not broker.accepting():
+        raise HTTPException(status_code=503, detail="Too many event stream clients")
+
+    return StreamingResponse(
+        broker.stream(tenant, request.headers.get("last-event-id") or last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Operator endpoints: process-wide numbers, never shown to tenants' visitors
+OPS_TOKEN = os.environ.get('OPS_TOKEN')
+
+async def require_ops_token(request: Request):
+    """Allow only callers presenting ``Authorization: Bearer <OPS_TOKEN>``"""
+    if not OPS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), OPS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Operator token required",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+@api_router.get("/ops/stats", dependencies=[Depends(require_ops_token)])
+async def get_stats():
+    """Get background queue, cache and event stream statistics for this process"""
+    cache = getattr(repository, "cache", None)
+    return {
+        "success": True,
+        "data": {
+            "jobs": jobs.stats(),
+            "image_jobs": image_jobs.stats(),
+            "cache": cache.stats() if cache else None,
+            "events": broker.stats(),
+            "payloads": {
+                "snapshot": payloads.stats(),
+                "refresher": payload_refresher.stats(),
+            } if payloads else None,
+        },
+    }
+
+# Written by a Mongo-backed node; snapshot-backed edge nodes pull it from here
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH')
+
+@api_router.get("/ops/snapshot", dependencies=[Depends(require_ops_token)])
+async def get_snapshot(request: Request):
+    """Download the SQLite snapshot this node exports (see SNAPSHOT_SOURCE_URL)"""
+    if repository.read_only or not SNAPSHOT_PATH or not os.path.exists(SNAPSHOT_PATH):
+        raise HTTPException(status_code=404, detail="This node does not export a snapshot")
+    stat = os.stat(SNAPSHOT_PATH)
+    etag = f'"{stat.st_ino:x}-{stat.st_mtime_ns:x}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return FileResponse(SNAPSHOT_PATH, media_type="application/vnd.sqlite3", headers={"ETag": etag})
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -225,13 +485,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Resolve the tenant (Host header or /t/<tenant> prefix) before routing
+app.add_middleware(TenantMiddleware)
+
+# Outermost: request ids and opt-in Server-Timing
+app.add_middleware(TracingMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
 )
+for handler in logging.getLogger().handlers:
+    handler.addFilter(RequestIdFilter())
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_client():
+    jobs.start()
+    stop_image_downloads.clear()
+    image_jobs.start()
+    await repository.startup()
+    broker.start(repository)
+    # Rebuilding needs Mongo and its change log; snapshot-backed nodes only read
+    if payload_refresher and repository.has_change_log:
+        payload_refresher.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    await close_db_client()
\ No newline at end of file
+    await broker.stop()
+    if payload_refresher:
+        await payload_refresher.stop()
+    # Image jobs write projects, which queue more post-write work, so they stop first
+    stop_image_downloads.set()
+    await image_jobs.stop()
+    await jobs.stop()
+    await repository.close()
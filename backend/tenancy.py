@@ -0,0 +1,89 @@
+"""Tenant resolution for hosting many portfolios from one process.
+
+``TENANT_MODE`` selects how the tenant is found:
+
+- ``single`` (default): one portfolio per deployment, queries are unscoped
+- ``host``: the ``Host`` header, minus any ``TENANT_HOST_SUFFIX``
+- ``path``: a ``/t/<tenant>`` prefix, stripped before routing
+"""
+import os
+import re
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+TENANT_MODE = os.environ.get('TENANT_MODE', 'single')
+TENANT_HOST_SUFFIX = os.environ.get('TENANT_HOST_SUFFIX', '').lower().strip(".")
+TENANT_PATH_PREFIX = "/t/"
+
+# Hostname-shaped: dot separated DNS labels
+TENANT_PATTERN = re.compile(r"^[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?(?:\.[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)*$")
+
+if TENANT_MODE not in ("single", "host", "path"):
+    raise RuntimeError(f"Unknown TENANT_MODE '{TENANT_MODE}'")
+
+
+def tenant_from_host(host: Optional[str]) -> Optional[str]:
+    """Derive the tenant from a Host header value"""
+    if not host:
+        return None
+    host = host.rsplit(":", 1)[0].lower().rstrip(".")
+    if TENANT_HOST_SUFFIX:
+        # Match whole labels only, so "badexample.com" is not "bad" + "example.com"
+        if host == TENANT_HOST_SUFFIX:
+            return None
+        if host.endswith("." + TENANT_HOST_SUFFIX):
+            host = host[:-len(TENANT_HOST_SUFFIX) - 1]
+    return host or None
+
+
+def split_tenant_path(path: str):
+    """Split ``/t/<tenant>/rest`` into the tenant and ``/rest``"""
+    if not path.startswith(TENANT_PATH_PREFIX):
+        return None, path
+    tenant, _, rest = path[len(TENANT_PATH_PREFIX):].partition("/")
+    return tenant.lower() or None, "/" + rest
+
+
+class TenantMiddleware:
+    """Resolve the tenant for each request and store it on ``request.state``"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or TENANT_MODE == "single":
+            await self.app(scope, receive, send)
+            return
+
+        if TENANT_MODE == "path":
+            tenant, path = split_tenant_path(scope["path"])
+            if tenant:
+                scope = dict(scope, path=path, raw_path=path.encode())
+        else:
+            tenant = tenant_from_host(Headers(scope=scope).get("host"))
+
+        if tenant is not None and not TENANT_PATTERN.match(tenant):
+            response = JSONResponse(status_code=400, content={"detail": "Invalid tenant"})
+            await response(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["tenant"] = tenant
+        await self.app(scope, receive, send)
+
+
+def get_tenant(request: Request) -> Optional[str]:
+    """Dependency returning the current tenant (``None`` in single mode)"""
+    if TENANT_MODE == "single":
+        return None
+    tenant = getattr(request.state, "tenant", None)
+    if not tenant:
+        raise HTTPException(status_code=400, detail="Tenant could not be resolved")
+    return tenant
@@ -0,0 +1,212 @@
+"""Per-request tracing: phase timings in ``Server-Timing``, request ids in logs,
+and ``explain()`` capture for slow Mongo commands."""
+import asyncio
+import functools
+import hmac
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers, MutableHeaders
+
+# off: never trace; header: trace requests sending "X-Trace: <TRACE_TOKEN>"; all: trace everything
+TRACE_REQUESTS = os.environ.get('TRACE_REQUESTS', 'header')
+# Timings reveal how the backend spends its time, so only holders of this
+# token may ask for them; header mode traces nothing while it is unset
+TRACE_TOKEN = os.environ.get('TRACE_TOKEN')
+# Mongo commands slower than this are logged with their plan (0 disables)
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+# A slow query shape (command, collection, filter keys) is explained at most
+# once per interval, with at most this many explains in flight, so a database
+# that is already slow is not handed a second query for each slow one
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', 60))
+SLOW_QUERY_MAX_EXPLAINS = int(os.environ.get('SLOW_QUERY_MAX_EXPLAINS', 2))
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+_trace_var: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_explain_tasks = set()
+# Query shape -> when it was last reported, and slow runs since then
+_last_explained = {}
+_suppressed = {}
+
+
+class Trace:
+    """Accumulated phase durations for one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.handler_end = None
+
+    def add(self, name: str, seconds: float):
+        total, count = self.phases.get(name, (0.0, 0))
+        self.phases[name] = (total + seconds, count + 1)
+
+    def header(self) -> str:
+        now = time.perf_counter()
+        if self.handler_end is not None:
+            self.add("serialize", now - self.handler_end)
+        metrics = []
+        for name, (seconds, count) in self.phases.items():
+            desc = f';desc="{count} calls"' if count > 1 else ""
+            metrics.append(f"{name};dur={seconds * 1000:.2f}{desc}")
+        metrics.append(f"total;dur={(now - self.start) * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+@contextmanager
+def span(name: str):
+    """Time a block as phase ``name`` of the current trace, if any"""
+    trace = _trace_var.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+@contextmanager
+def query_span(db, command: Optional[dict], name: str = "db"):
+    """Time a Mongo command as phase ``name`` and explain it if it was slow.
+
+    ``command`` is the equivalent database command document used for
+    ``explain``; pass ``None`` for commands that cannot be explained.
+    """
+    start = time.perf_counter()
+    with span(name):
+        yield
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if SLOW_QUERY_MS and elapsed_ms > SLOW_QUERY_MS:
+        _report_slow_query(db, command, elapsed_ms)
+
+
+def _query_shape(command: Optional[dict]) -> tuple:
+    """Command name, collection and filter keys, without the filter values"""
+    if not command:
+        return ("insert",)
+    name = next(iter(command))
+    query = command.get("filter", command.get("query")) or {}
+    return (name, str(command[name]), tuple(sorted(query)))
+
+
+def _report_slow_query(db, command, elapsed_ms):
+    shape = _query_shape(command)
+    now = time.monotonic()
+    last = _last_explained.get(shape)
+    if (last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL) \
+            or len(_explain_tasks) >= SLOW_QUERY_MAX_EXPLAINS:
+        _suppressed[shape] = _suppressed.get(shape, 0) + 1
+        return
+    _last_explained[shape] = now
+    repeats = _suppressed.pop(shape, 0)
+    # create_task copies the context, so the log keeps the request id
+    task = asyncio.get_running_loop().create_task(_log_slow_query(db, command, elapsed_ms, repeats))
+    _explain_tasks.add(task)
+    task.add_done_callback(_explain_tasks.discard)
+
+
+async def _log_slow_query(db, command, elapsed_ms, repeats=0):
+    description = json.dumps(command, default=str) if command else "insert"
+    if repeats:
+        description += f" (+{repeats} slow runs of this shape not reported)"
+    if command is None:
+        logging.warning(f"Slow Mongo command ({elapsed_ms:.1f} ms): {description}")
+        return
+    try:
+        plan = await db.command({"explain": command, "verbosity": "queryPlanner"})
+        winning_plan = plan.get("queryPlanner", {}).get("winningPlan", plan)
+        logging.warning(
+            f"Slow Mongo command ({elapsed_ms:.1f} ms): {description} "
+            f"plan: {json.dumps(winning_plan, default=str)}"
+        )
+    except Exception as e:
+        logging.warning(f"Slow Mongo command ({elapsed_ms:.1f} ms): {description} (explain failed: {str(e)})")
+
+
+class TracedRoute(APIRoute):
+    """Route that times the endpoint itself, so the remainder up to the
+    response headers can be reported as serialization"""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+
+def _timed_endpoint(endpoint):
+    # include_router rebuilds routes from already wrapped endpoints
+    if getattr(endpoint, "_timed", False):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        trace = _trace_var.get()
+        if trace is None:
+            return await endpoint(*args, **kwargs)
+        with span("handler"):
+            result = await endpoint(*args, **kwargs)
+        trace.handler_end = time.perf_counter()
+        return result
+    wrapper._timed = True
+    return wrapper
+
+
+def _trace_requested(headers: Headers) -> bool:
+    value = headers.get("x-trace")
+    return bool(TRACE_TOKEN and value) and hmac.compare_digest(value.encode(), TRACE_TOKEN.encode())
+
+
+class TracingMiddleware:
+    """Assign a request id and, when tracing is on, add ``Server-Timing``"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        request_id = headers.get("x-request-id", "")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        requested = TRACE_REQUESTS == "header" and _trace_requested(headers)
+        trace = Trace() if requested or TRACE_REQUESTS == "all" else None
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                response_headers = MutableHeaders(scope=message)
+                response_headers.append("X-Request-ID", request_id)
+                if trace is not None:
+                    response_headers.append("Server-Timing", trace.header())
+                    # Only a token holder may read timings from scripts on other origins
+                    if requested:
+                        response_headers.append("Timing-Allow-Origin", "*")
+            await send(message)
+
+        request_id_token = request_id_var.set(request_id)
+        trace_token = _trace_var.set(trace)
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _trace_var.reset(trace_token)
+            request_id_var.reset(request_id_token)
+
+
+class RequestIdFilter(logging.Filter):
+    """Tag log records with the current request id"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
@@ -6,7 +6,7 @@ import ProjectCard from './components/ProjectCard';
 import ServiceCard from './components/ServiceCard';
 import LoadingSpinner from './components/LoadingSpinner';
 import ProjectDetail from './components/ProjectDetail';
-import { portfolioAPI, servicesAPI, projectsAPI } from './services/api';
+import { portfolioAPI, servicesAPI, projectsAPI, eventsAPI } from './services/api';
 
 const HomePage = () => {
   // State for data
@@ -85,6 +85,19 @@ const HomePage = () => {
     loadData();
   }, []);
 
+  // Refetch whatever changed when the backend pushes an update
+  useEffect(() => {
+    const refetch = {
+      portfolio: fetchPortfolio,
+      services: fetchServices,
+      projects: fetchProjects,
+    };
+    return eventsAPI.subscribe(
+      (change) => refetch[change.collection]?.(),
+      () => Promise.all([fetchPortfolio(), fetchServices(), fetchProjects()])
+    );
+  }, []);
+
   const handleContactClick = () => {
     if (portfolioData?.personal?.email) {
       window.location.href = `mailto:${portfolioData.personal.email}`;
@@ -76,6 +76,14 @@ const ProjectDetail = ({ portfolioData }) => {
     );
   }
 
+  // Precomputed size and dominant color per image URL, painted until the image loads
+  const imageMeta = Object.fromEntries((project.images || []).map((meta) => [meta.url, meta]));
+  const placeholderProps = (image) => ({
+    width: imageMeta[image]?.width,
+    height: imageMeta[image]?.height,
+    style: { backgroundColor: imageMeta[image]?.color },
+  });
+
   return (
     <div className="min-h-screen bg-white">
       {portfolioData && (
@@ -170,6 +178,7 @@ const ProjectDetail = ({ portfolioData }) => {
                     <img 
                       src={image} 
                       alt={`${project.title} - Image ${index + 1}`}
+                      {...placeholderProps(image)}
                       className="w-full h-full object-cover"
                       onError={(e) => {
                         e.target.src = 'https://via.placeholder.com/1200x500?text=Image+Not+Available';
@@ -195,6 +204,7 @@ const ProjectDetail = ({ portfolioData }) => {
                   <img 
                     src={image} 
                     alt={`${project.title} - Detail ${index + 1}`}
+                    {...placeholderProps(image)}
                     className="w-full h-64 md:h-80 object-cover hover:scale-105 transition-transform duration-300"
                     onError={(e) => {
                       e.target.src = 'https://via.placeholder.com/800x600?text=Image+Not+Available';
@@ -155,4 +155,58 @@ export const projectsAPI = {
   },
 };
 
+// Live updates (Server-Sent Events)
+export const eventsAPI = {
+  // Subscribe to change notifications; returns an unsubscribe function.
+  // The browser resends Last-Event-ID on its own reconnects, so the server
+  // replays what was missed; if the stream is closed for good (e.g. an error
+  // status during a restart) it is reopened from the last change seen.
+  subscribe: (onChange, onReset) => {
+    if (typeof EventSource === 'undefined') {
+      return () => {};
+    }
+    let source = null;
+    let retryTimer = null;
+    let lastSeq = null;
+    let closed = false;
+
+    const open = () => {
+      const query = lastSeq !== null ? `?last_event_id=${lastSeq}` : '';
+      source = new EventSource(`${API_BASE}/events${query}`);
+      source.addEventListener('change', (event) => {
+        try {
+          const change = JSON.parse(event.data);
+          lastSeq = change.seq;
+          onChange(change);
+        } catch (error) {
+          console.error('Invalid change event:', error);
+        }
+      });
+      source.addEventListener('reset', () => {
+        lastSeq = null;
+        onReset();
+      });
+      source.onerror = () => {
+        if (closed || source.readyState !== EventSource.CLOSED) {
+          return;
+        }
+        retryTimer = setTimeout(() => {
+          // Without a known position the replay is impossible; refetch instead
+          if (lastSeq === null) {
+            onReset();
+          }
+          open();
+        }, 5000);
+      };
+    };
+
+    open();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      source.close();
+    };
+  },
+};
+
 export default api;
\ No newline at end of file
@@ -0,0 +1,43 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules import each other by plain name, as when run from backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Point ``database``'s collections at an in-memory mongomock database"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import database
+
+    client = mongomock_motor.AsyncMongoMockClient()
+    db = client["test"]
+
+    async def create_collection(name, **options):
+        # mongomock has no capped collections; a plain one behaves the same here
+        return db[name]
+
+    object.__setattr__(db, "create_collection", create_collection)
+    monkeypatch.setattr(database, "client", client)
+    monkeypatch.setattr(database, "db", db)
+    for name in ("portfolio", "services", "projects", "changes", "counters"):
+        monkeypatch.setattr(database, f"{name}_collection", db[name])
+    return db
+
+
+@pytest.fixture
+def api(mongo, monkeypatch):
+    """TestClient on the app, with its repository rebuilt on the ``mongo`` database"""
+    from fastapi.testclient import TestClient
+
+    import server
+    from repository import create_repository
+
+    repository = create_repository(server.jobs)
+    monkeypatch.setattr(server, "repository", repository)
+    monkeypatch.setattr(server.related_projects, "repository", repository)
+    with TestClient(server.app) as client:
+        yield client
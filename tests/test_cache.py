@@ -0,0 +1,76 @@
+import json
+
+import cache
+from cache import TenantCache
+
+
+def size(value):
+    return len(json.dumps(value))
+
+
+def test_get_returns_put_value_and_counts_hits():
+    tenant_cache = TenantCache(tenant_bytes=1000, total_bytes=10000, ttl=60)
+    assert tenant_cache.get("a", "projects") is None
+    tenant_cache.put("a", "projects", [1, 2])
+    assert tenant_cache.get("a", "projects") == [1, 2]
+    assert tenant_cache.get("b", "projects") is None
+    stats = tenant_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 1)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    tenant_cache = TenantCache(tenant_bytes=1000, total_bytes=10000, ttl=5)
+    tenant_cache.put("a", "projects", "x")
+    now[0] += 4
+    assert tenant_cache.get("a", "projects") == "x"
+    now[0] += 2
+    assert tenant_cache.get("a", "projects") is None
+    assert tenant_cache.stats()["bytes"] == 0
+
+
+def test_tenant_budget_evicts_least_recently_used_entry():
+    value = "x" * 40
+    tenant_cache = TenantCache(tenant_bytes=size(value) * 2, total_bytes=10000, ttl=60)
+    tenant_cache.put("a", "one", value)
+    tenant_cache.put("a", "two", value)
+    tenant_cache.get("a", "one")
+    tenant_cache.put("a", "three", value)
+    assert tenant_cache.get("a", "two") is None
+    assert tenant_cache.get("a", "one") == value
+    assert tenant_cache.get("a", "three") == value
+    assert tenant_cache.stats()["evictions"] == 1
+
+
+def test_total_budget_evicts_least_recently_used_tenant_whole():
+    value = "x" * 40
+    tenant_cache = TenantCache(tenant_bytes=10000, total_bytes=size(value) * 4, ttl=60)
+    for tenant in ("a", "b"):
+        tenant_cache.put(tenant, "one", value)
+        tenant_cache.put(tenant, "two", value)
+    tenant_cache.get("a", "one")
+    tenant_cache.put("c", "one", value)
+    assert tenant_cache.get("b", "one") is None and tenant_cache.get("b", "two") is None
+    assert tenant_cache.get("a", "two") == value
+    stats = tenant_cache.stats()
+    assert stats["tenants"] == 2 and stats["evictions"] == 2
+    assert stats["bytes"] == size(value) * 3
+
+
+def test_oversized_values_are_not_cached():
+    tenant_cache = TenantCache(tenant_bytes=10, total_bytes=10000, ttl=60)
+    tenant_cache.put("a", "big", "x" * 100)
+    assert tenant_cache.get("a", "big") is None
+
+
+def test_replacing_and_invalidating_keep_sizes_consistent():
+    tenant_cache = TenantCache(tenant_bytes=1000, total_bytes=10000, ttl=60)
+    tenant_cache.put("a", "k", "short")
+    tenant_cache.put("a", "k", "a longer value")
+    tenant_cache.put("b", "k", "other")
+    assert tenant_cache.stats()["bytes"] == size("a longer value") + size("other")
+    tenant_cache.invalidate("a")
+    tenant_cache.invalidate("missing")
+    assert tenant_cache.get("a", "k") is None
+    assert tenant_cache.stats()["bytes"] == size("other")
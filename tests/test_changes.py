@@ -0,0 +1,193 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+import repository as repository_module
+from repository import CHANGE_GAP_GRACE, CHANGE_TAIL_WINDOW, MongoRepository
+
+
+def entry(seq, age=timedelta(0), tenant="a"):
+    return {
+        "tenant": tenant, "seq": seq, "collection": "projects", "op": "update",
+        "id": f"p{seq}", "ts": datetime.utcnow() - age,
+    }
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def changes(mongo):
+    """Fill tenant "a"'s change log with ``entries`` and set its counter to ``latest``"""
+    repository = MongoRepository()
+
+    def fill(entries, latest=None):
+        async def insert():
+            for item in entries:
+                await mongo.changes.insert_one(item)
+            # Another tenant's log must never leak into or disturb tenant "a"'s
+            await mongo.changes.insert_one(entry(1, tenant="b"))
+            await mongo.counters.insert_one({"_id": "changes:b", "seq": 1})
+            if latest is not None:
+                await mongo.counters.insert_one({"_id": "changes:a", "seq": latest})
+        run(insert())
+        return lambda since, limit=100: run(repository.list_changes("a", since, limit))
+    return fill
+
+
+def seqs(result):
+    return [change["seq"] for change in result["changes"]]
+
+
+def test_returns_entries_after_since(changes):
+    list_changes = changes([entry(1), entry(2), entry(3)], latest=3)
+
+    result = list_changes(1)
+    assert (seqs(result), result["next"], result["reset"], result["pending"]) == ([2, 3], 3, False, False)
+    assert set(result["changes"][0]) == {"seq", "collection", "op", "id", "ts"}
+
+    result = list_changes(0, limit=2)
+    assert (seqs(result), result["next"], result["reset"], result["pending"]) == ([1, 2], 2, False, False)
+
+
+def test_up_to_date_client_gets_nothing(changes):
+    list_changes = changes([entry(1), entry(2)], latest=2)
+    assert list_changes(2) == {"changes": [], "next": 2, "reset": False, "pending": False}
+
+
+def test_since_beyond_latest_resets(changes):
+    list_changes = changes([entry(1), entry(2)], latest=2)
+    assert list_changes(7) == {"changes": [], "next": 2, "reset": True, "pending": False}
+
+
+def test_unknown_tenant_with_position_resets(changes):
+    list_changes = changes([])
+    assert list_changes(0) == {"changes": [], "next": 0, "reset": False, "pending": False}
+    assert list_changes(3) == {"changes": [], "next": 0, "reset": True, "pending": False}
+
+
+def test_entries_rolled_out_of_the_log_reset(changes):
+    # Entries 1-4 were evicted from the capped collection
+    list_changes = changes([entry(5), entry(6)], latest=6)
+
+    assert list_changes(2) == {"changes": [], "next": 6, "reset": True, "pending": False}
+    result = list_changes(4)
+    assert (seqs(result), result["next"], result["reset"], result["pending"]) == ([5, 6], 6, False, False)
+
+
+def test_stops_at_young_sequence_hole(changes):
+    # Seq 3 is allocated but its writer has not logged it yet
+    list_changes = changes([entry(1), entry(2), entry(4)], latest=4)
+
+    result = list_changes(0)
+    assert (seqs(result), result["next"], result["reset"], result["pending"]) == ([1, 2], 2, False, True)
+    result = list_changes(2)
+    assert (seqs(result), result["next"], result["reset"], result["pending"]) == ([], 2, False, True)
+
+
+def test_skips_sequence_hole_older_than_grace(changes):
+    # The writer of seq 3 failed long ago; waiting on it would stall every client
+    old = CHANGE_GAP_GRACE * 2
+    list_changes = changes([entry(1, old), entry(2, old), entry(4, old), entry(5)], latest=5)
+
+    result = list_changes(0)
+    assert (seqs(result), result["next"], result["reset"], result["pending"]) == ([1, 2, 4, 5], 5, False, False)
+
+
+class FakeCursor:
+    """Tailable cursor that returns what matched when opened, then dies"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.alive = True
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self.entries:
+            yield item
+        self.alive = False
+
+
+class FakeChanges:
+    """Capped collection in insertion (``$natural``) order"""
+
+    def __init__(self):
+        self.entries = []
+        self.opened = 0
+
+    def append(self, seq, ts):
+        # _ids come from each writer's clock and machine, not insertion order
+        self.entries.append({"_id": ObjectId(), "seq": seq, "ts": ts})
+
+    async def find_one(self, query, projection=None, sort=None):
+        return self.entries[-1] if self.entries else None
+
+    def find(self, query, projection=None, cursor_type=None):
+        self.opened += 1
+        since = query.get("ts", {}).get("$gte")
+        return FakeCursor([item for item in self.entries if since is None or item["ts"] >= since])
+
+
+def test_reopened_tail_cursor_yields_each_entry_once(monkeypatch):
+    monkeypatch.setattr(repository_module, "CHANGE_TAIL_RETRY_SECONDS", 0.01)
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    log = FakeChanges()
+    log.append(1, start)
+    log.append(2, start + timedelta(seconds=2))
+    repository = MongoRepository()
+    repository.changes = log
+
+    async def scenario():
+        yielded = []
+
+        async def consume():
+            async for item in repository.tail_changes():
+                yielded.append(item["seq"])
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        # Inserted after seq 2 but stamped before it by a writer with a slower clock
+        log.append(3, start + timedelta(seconds=1))
+        log.append(4, start + timedelta(seconds=3))
+        await asyncio.sleep(0.05)
+        log.append(5, start + timedelta(seconds=4))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return yielded
+
+    # Entries already in the log when tailing starts are not replayed
+    assert run(scenario()) == [3, 4, 5]
+    assert log.opened > 3
+
+
+def test_tail_rereads_only_the_window_before_the_newest_entry(monkeypatch):
+    monkeypatch.setattr(repository_module, "CHANGE_TAIL_RETRY_SECONDS", 0.01)
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    log = FakeChanges()
+    log.append(1, start)
+    log.append(2, start + CHANGE_TAIL_WINDOW * 2)
+    repository = MongoRepository()
+    repository.changes = log
+    queries = []
+    find = log.find
+
+    def recording_find(query, *args, **kwargs):
+        queries.append(query)
+        return find(query, *args, **kwargs)
+    log.find = recording_find
+
+    async def scenario():
+        tail = repository.tail_changes()
+        task = asyncio.ensure_future(tail.__anext__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    run(scenario())
+
+    assert {q["ts"]["$gte"] for q in queries} == {start + CHANGE_TAIL_WINDOW}
@@ -0,0 +1,121 @@
+import asyncio
+
+import events
+
+
+def change(seq, tenant="a"):
+    return {"tenant": tenant, "seq": seq, "collection": "projects", "op": "update", "id": f"p{seq}"}
+
+
+class FakeRepository:
+    """Change log of one tenant: entries ``first..latest``, older ones evicted"""
+
+    has_change_log = True
+
+    def __init__(self, latest, first=1, pending_after=None):
+        self.latest = latest
+        self.first = first
+        self.pending_after = pending_after
+
+    async def latest_change(self, tenant):
+        return self.latest
+
+    async def list_changes(self, tenant, since, limit):
+        if since < self.first - 1:
+            return {"changes": [], "next": self.latest, "reset": True, "pending": False}
+        last = self.latest if self.pending_after is None else min(self.latest, self.pending_after)
+        seqs = list(range(since + 1, last + 1))[:limit]
+        pending = self.pending_after is not None and since + len(seqs) < self.latest
+        return {
+            "changes": [change(seq) for seq in seqs],
+            "next": seqs[-1] if seqs else since,
+            "reset": False,
+            "pending": pending,
+        }
+
+
+def broker_for(repository):
+    broker = events.EventBroker()
+    broker.repository = repository
+    broker._tasks = [object()]  # running, without tailing
+    return broker
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_new_stream_sends_current_position():
+    async def scenario():
+        stream = broker_for(FakeRepository(latest=7)).stream("a")
+        return await stream.__anext__()
+    assert run(scenario()) == events.RETRY_EVENT + b"id: 7\n\n"
+
+
+def test_reconnect_replays_missed_changes_once():
+    async def scenario():
+        broker = broker_for(FakeRepository(latest=5))
+        stream = broker.stream("a", "3")
+        first = await stream.__anext__()
+        following = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        broker.publish(change(5))  # already replayed
+        broker.publish(change(6))
+        second = await following
+        await stream.aclose()
+        return first, second
+    first, second = run(scenario())
+    assert first == (
+        events.RETRY_EVENT + events.encode_change(change(4)) + events.encode_change(change(5)) + b"id: 5\n\n"
+    )
+    assert second == events.encode_change(change(6))
+
+
+def test_reconnect_when_up_to_date_sends_nothing_extra():
+    async def scenario():
+        return await broker_for(FakeRepository(latest=5)).stream("a", "5").__anext__()
+    assert run(scenario()) == events.RETRY_EVENT + b"id: 5\n\n"
+
+
+def test_reconnect_resets_when_changes_were_evicted():
+    async def scenario():
+        return await broker_for(FakeRepository(latest=50, first=40)).stream("a", "10").__anext__()
+    assert run(scenario()) == events.RETRY_EVENT + events.RESET_EVENT + b"id: 50\n\n"
+
+
+def test_reconnect_resets_when_too_far_behind(monkeypatch):
+    monkeypatch.setattr(events, "SSE_REPLAY_LIMIT", 3)
+
+    async def scenario():
+        return await broker_for(FakeRepository(latest=10)).stream("a", "2").__anext__()
+    assert run(scenario()) == events.RETRY_EVENT + events.RESET_EVENT + b"id: 10\n\n"
+
+
+def test_reconnect_resets_on_write_in_flight():
+    async def scenario():
+        return await broker_for(FakeRepository(latest=6, pending_after=4)).stream("a", "2").__anext__()
+    assert run(scenario()).startswith(events.RETRY_EVENT + events.RESET_EVENT)
+
+
+def test_reconnect_resets_on_invalid_id():
+    async def scenario():
+        return await broker_for(FakeRepository(latest=3)).stream("a", "abc").__anext__()
+    assert run(scenario()) == events.RETRY_EVENT + events.RESET_EVENT + b"id: 3\n\n"
+
+
+def test_slow_client_falls_off_buffer_and_gets_reset(monkeypatch):
+    monkeypatch.setattr(events, "SSE_BUFFER_SIZE", 3)
+
+    async def scenario():
+        broker = broker_for(FakeRepository(latest=0))
+        stream = broker.stream("a")
+        await stream.__anext__()
+        for seq in range(1, 8):
+            broker.publish(change(seq))
+        broker.publish(change(1, tenant="b"))  # no subscribers, dropped
+        reset = await stream.__anext__()
+        await stream.aclose()
+        return reset, broker.stats()
+    reset, stats = run(scenario())
+    assert reset == events.RESET_EVENT
+    assert stats["clients"] == 0 and stats["tenants"] == 0 and stats["published"] == 7
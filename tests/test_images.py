@@ -0,0 +1,274 @@
+import asyncio
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import images
+
+FIXTURES = Path(__file__).parent / "fixtures"
+GRADIENT = str(FIXTURES / "gradient.png")
+TWO_TONE = str(FIXTURES / "two-tone.png")
+SOLID = str(FIXTURES / "solid.jpg")
+
+
+def pixels(path):
+    with Image.open(path) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+@pytest.mark.parametrize("path, expected", [
+    (GRADIENT, "LxH28X2zw$XAmIWYjuf8gJfjfQfj"),
+    (TWO_TONE, "L=G0a~0s?6R;ozWFoJa#fQfQfQfQ"),
+])
+def test_blurhash_matches_pinned_values(path, expected):
+    assert images.blurhash(pixels(path)) == expected
+
+
+@pytest.mark.parametrize("components", [(4, 3), (1, 1), (5, 2)])
+def test_blurhash_matches_reference_encoder(components):
+    reference = pytest.importorskip("blurhash")
+    array = pixels(GRADIENT)
+    assert images.blurhash(array, components) == reference.encode(
+        array, components_x=components[0], components_y=components[1]
+    )
+
+
+@pytest.mark.parametrize("components", [(4, 3), (1, 1), (9, 9)])
+def test_blurhash_length_follows_component_count(components):
+    encoded = images.blurhash(pixels(GRADIENT), components)
+    assert len(encoded) == 6 + 2 * (components[0] * components[1] - 1)
+    assert encoded[0] == images.BASE83[(components[0] - 1) + (components[1] - 1) * 9]
+
+
+def test_dominant_color_picks_the_largest_area():
+    assert images.dominant_color(pixels(TWO_TONE)) == "#1478c8"
+
+
+def test_dominant_color_is_stable_against_noise():
+    rng = np.random.default_rng(0)
+    base = np.full((32, 32, 3), (100, 150, 200), dtype=np.int16)
+    noisy = np.clip(base + rng.integers(-3, 4, base.shape), 0, 255).astype(np.uint8)
+    r, g, b = (int(images.dominant_color(noisy)[i:i + 2], 16) for i in (1, 3, 5))
+    assert abs(r - 100) <= 3 and abs(g - 150) <= 3 and abs(b - 200) <= 3
+
+
+def test_describe_image_reads_local_fixtures():
+    assert images.describe_image(TWO_TONE, allow_local=True) == {
+        "url": TWO_TONE,
+        "width": 30,
+        "height": 20,
+        "color": "#1478c8",
+        "blurhash": "L=G0a~0s?6R;ozWFoJa#fQfQfQfQ",
+    }
+    solid = images.describe_image(f"file://{SOLID}", allow_local=True)
+    assert (solid["width"], solid["height"]) == (40, 30)
+    r, g, b = (int(solid["color"][i:i + 2], 16) for i in (1, 3, 5))
+    assert abs(r - 200) <= 4 and abs(g - 60) <= 4 and abs(b - 40) <= 4
+
+
+def test_describe_image_rejects_oversized_images(monkeypatch):
+    monkeypatch.setattr(images, "MAX_IMAGE_PIXELS", 30 * 20 - 1)
+    with pytest.raises(ValueError, match="more than"):
+        images.describe_image(TWO_TONE, allow_local=True)
+
+
+def test_describe_project_images_reuses_stored_metadata(monkeypatch):
+    stored = {"url": GRADIENT, "width": 1, "height": 1, "color": "#000000", "blurhash": "stored"}
+    project = {"thumbnail_image": GRADIENT, "static_images": [TWO_TONE, GRADIENT], "images": [stored]}
+    described = []
+    real = images.describe_image
+    monkeypatch.setattr(images, "describe_image", lambda url, *args: described.append(url) or real(url, True))
+
+    result = images.describe_project_images(project, allow_local=True)
+    assert described == [TWO_TONE]
+    assert result[0] is stored and result[1]["url"] == TWO_TONE
+
+    project["images"] = result
+    assert images.describe_project_images(project, allow_local=True) is None
+    assert described == [TWO_TONE]
+
+    assert len(images.describe_project_images(project, force=True, allow_local=True)) == 2
+    assert described == [TWO_TONE, GRADIENT, TWO_TONE]
+
+
+def test_describe_project_images_skips_failures(caplog):
+    project = {"thumbnail_image": str(FIXTURES / "missing.png"), "carousel_images": [TWO_TONE]}
+    result = images.describe_project_images(project, allow_local=True)
+    assert [image["url"] for image in result] == [TWO_TONE]
+    assert "Skipping image" in caplog.text
+
+
+def test_describe_project_images_caps_urls_per_project(monkeypatch):
+    monkeypatch.setattr(images, "MAX_IMAGES_PER_PROJECT", 2)
+    monkeypatch.setattr(images, "describe_image", lambda url, *args: {"url": url})
+    project = {"static_images": [f"https://example.com/{i}.png" for i in range(5)]}
+    assert len(images.describe_project_images(project)) == 2
+
+
+def test_client_urls_cannot_read_local_files():
+    with pytest.raises(ValueError, match="Only http"):
+        images.describe_image(TWO_TONE)
+    with pytest.raises(ValueError, match="Only http"):
+        images.describe_image(TWO_TONE, allow_local=False)
+    with pytest.raises(ValueError, match="Only http"):
+        images.describe_image(f"file://{TWO_TONE}", allow_local=False)
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/image.png",
+    "http://localhost:8001/image.png",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.0.0.5/image.png",
+    "http://[::1]/image.png",
+    "http://[::ffff:127.0.0.1]/image.png",
+    "http://224.0.0.1/image.png",
+])
+def test_client_urls_cannot_reach_private_hosts(monkeypatch, url):
+    def no_network(*args, **kwargs):
+        raise AssertionError("request must not be sent")
+    monkeypatch.setattr(images.urllib3, "HTTPConnectionPool", no_network)
+    with pytest.raises(ValueError, match="not a public address"):
+        images.describe_image(url, allow_local=False)
+
+
+def test_redirects_to_private_hosts_are_rejected(monkeypatch):
+    class Redirect:
+        def get_redirect_location(self):
+            return "http://127.0.0.1/secret"
+
+        def release_conn(self):
+            pass
+
+    requested = []
+
+    class Pool:
+        def __init__(self, host, port, **kwargs):
+            self.address = (host, port)
+
+        def urlopen(self, method, target, headers, **kwargs):
+            requested.append((self.address, target, headers["Host"]))
+            return Redirect()
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(images.socket, "getaddrinfo", lambda host, port: [
+        (None, None, None, "", ("93.184.216.34" if host == "example.com" else "127.0.0.1", 0))
+    ])
+    monkeypatch.setattr(images.urllib3, "HTTPConnectionPool", Pool)
+    with pytest.raises(ValueError, match="not a public address"):
+        images.describe_image("http://example.com/image.png?v=2", allow_local=False)
+    # Sent to the address that was checked, not looked up again
+    assert requested == [(("93.184.216.34", 80), "/image.png?v=2", "example.com")]
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers["Host"]))
+        if self.path == "/drip":
+            self.send_response(200)
+            self.send_header("Content-Length", "1000")
+            self.end_headers()
+            for _ in range(1000):
+                try:
+                    self.wfile.write(b"x")
+                    self.wfile.flush()
+                except OSError:
+                    return
+                time.sleep(0.05)
+            return
+        body = Path(TWO_TONE).read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def image_host(monkeypatch):
+    """Local server reachable as ``images.test``; yields its port and the names looked up"""
+    ImageHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    lookups = []
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        lookups.append(host)
+        if host == "images.test":
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port or 0))]
+        return real_getaddrinfo(host, port, *args, **kwargs)
+    monkeypatch.setattr(images.socket, "getaddrinfo", getaddrinfo)
+    yield server.server_port, lookups
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_connects_to_the_resolved_address(image_host):
+    port, lookups = image_host
+    described = images.describe_image(f"http://images.test:{port}/two-tone.png", allow_local=True)
+
+    assert described["color"] == "#1478c8"
+    assert ImageHandler.requests == [("/two-tone.png", f"images.test:{port}")]
+    assert lookups.count("images.test") == 1
+
+
+def test_slow_download_stops_at_its_deadline(image_host):
+    port, _ = image_host
+    started = time.monotonic()
+    with pytest.raises(ValueError, match="ran out of time"):
+        images.describe_image(f"http://images.test:{port}/drip", allow_local=True, deadline=started + 0.3)
+    assert time.monotonic() - started < 1
+
+
+def test_download_gives_up_when_cancelled(image_host):
+    port, _ = image_host
+    cancelled = threading.Event()
+    threading.Timer(0.2, cancelled.set).start()
+    with pytest.raises(ValueError, match="cancelled"):
+        images.describe_image(f"http://images.test:{port}/drip", allow_local=True, cancelled=cancelled)
+
+
+def test_project_images_past_the_job_deadline_wait_for_the_next_run(monkeypatch, caplog):
+    monkeypatch.setattr(images, "IMAGE_JOB_SECONDS", 0)
+    stored = {"url": GRADIENT, "width": 1, "height": 1, "color": "#000000", "blurhash": "stored"}
+    project = {"thumbnail_image": TWO_TONE, "static_images": [GRADIENT], "images": [stored]}
+
+    assert images.describe_project_images(project) is None
+    assert "left 1 images for the next run" in caplog.text
+
+
+def test_offline_run_writes_through_the_repository(mongo, monkeypatch, tmp_path):
+    from repository import SnapshotRepository
+
+    monkeypatch.setenv("SNAPSHOT_PATH", str(tmp_path / "snapshot.db"))
+
+    def insert(tenant, key, **fields):
+        project = {"tenant": tenant, "id": key, "title": key, "active": True, "order": 0, **fields}
+        asyncio.run(mongo.projects.insert_one(project))
+    insert("a", "p1", thumbnail_image=TWO_TONE)
+    insert("b", "p1", static_images=[SOLID])
+    insert("b", "p2")
+
+    asyncio.run(images.process_all_projects())
+    # Local files are only read with --allow-local
+    assert asyncio.run(mongo.projects.count_documents({"images": {"$exists": True}})) == 0
+
+    asyncio.run(images.process_all_projects(allow_local=True))
+    changes = asyncio.run(mongo.changes.find({}, {"_id": 0, "tenant": 1, "id": 1, "fields": 1}).to_list(None))
+    assert sorted((c["tenant"], c["fields"]) for c in changes) == [("a", ["images"]), ("b", ["images"])]
+    snapshot = SnapshotRepository(tmp_path / "snapshot.db")
+    assert asyncio.run(snapshot.get_project("a", "p1"))["images"][0]["color"] == "#1478c8"
+    assert asyncio.run(snapshot.get_project("b", "p1"))["images"][0]["width"] == 40
@@ -0,0 +1,138 @@
+import asyncio
+
+from jobs import JobQueue
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_pending_jobs_with_the_same_key_are_merged():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        queue.start()
+        calls = []
+
+        async def job(value):
+            calls.append(value)
+
+        assert queue.submit("rebuild", job, 1)
+        assert queue.submit("rebuild", job, 2)
+        assert queue.submit("other", job, 3)
+        await queue.stop()
+        return calls, queue.stats()
+    calls, stats = run(scenario())
+    assert calls == [1, 3]
+    assert stats["deduplicated"] == 1 and stats["completed"] == 2
+
+
+def test_running_job_does_not_absorb_new_submissions():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        queue.start()
+        started = asyncio.Event()
+        release = asyncio.Event()
+        calls = []
+
+        async def job(value):
+            calls.append(value)
+            started.set()
+            await release.wait()
+
+        queue.submit("rebuild", job, 1)
+        await started.wait()
+        queue.submit("rebuild", job, 2)
+        release.set()
+        await queue.stop()
+        return calls
+    assert run(scenario()) == [1, 2]
+
+
+def test_failures_are_retried_with_backoff_until_success():
+    async def scenario():
+        queue = JobQueue(workers=1, backoff=0.01)
+        queue.start()
+        attempts = []
+
+        async def flaky():
+            attempts.append(asyncio.get_running_loop().time())
+            if len(attempts) < 3:
+                raise RuntimeError("boom")
+
+        queue.submit("flaky", flaky)
+        while queue.stats()["completed"] == 0:
+            await asyncio.sleep(0.005)
+        await queue.stop()
+        return attempts, queue.stats()
+    attempts, stats = run(scenario())
+    assert len(attempts) == 3
+    assert stats["retried"] == 2 and stats["failed"] == 0
+    # Second delay is drawn from [0.01, 0.02): jittered, doubling
+    assert attempts[2] - attempts[1] >= 0.01 * 0.9
+
+
+def test_job_fails_after_max_attempts():
+    async def scenario():
+        queue = JobQueue(workers=1, max_attempts=2, backoff=0.001)
+        queue.start()
+        attempts = []
+
+        async def broken():
+            attempts.append(1)
+            raise RuntimeError("boom")
+
+        queue.submit("broken", broken)
+        while queue.stats()["failed"] == 0:
+            await asyncio.sleep(0.005)
+        await queue.stop()
+        return len(attempts), queue.stats()
+    attempts, stats = run(scenario())
+    assert attempts == 2 and stats["retried"] == 1 and stats["failed"] == 1
+
+
+def test_full_queue_drops_jobs():
+    async def scenario():
+        queue = JobQueue(maxsize=1, workers=1)
+        queue.start()
+
+        async def job():
+            pass
+
+        accepted = [queue.submit(key, job) for key in ("a", "b")]
+        await queue.stop()
+        return accepted, queue.stats()
+    accepted, stats = run(scenario())
+    assert accepted == [True, False] and stats["dropped"] == 1
+
+
+def test_stop_drains_queued_jobs_and_pending_retries():
+    async def scenario():
+        queue = JobQueue(workers=1, backoff=60)
+        queue.start()
+        calls = []
+
+        async def job(value):
+            calls.append(value)
+
+        async def fails_once():
+            calls.append("retry")
+            if calls.count("retry") == 1:
+                raise RuntimeError("boom")
+
+        queue.submit("retry", fails_once)
+        for value in range(3):
+            queue.submit(value, job, value)
+        await asyncio.sleep(0.01)
+        # The retry is waiting on a 30-60 s backoff; stop runs it right away
+        await queue.stop(timeout=1)
+        accepted_after_stop = queue.submit("late", job, "late")
+        return calls, accepted_after_stop
+    calls, accepted_after_stop = run(scenario())
+    assert sorted(map(str, calls)) == ["0", "1", "2", "retry", "retry"]
+    assert accepted_after_stop is False
+
+
+def test_submit_before_start_is_rejected():
+    async def job():
+        pass
+    assert JobQueue().submit("x", job) is False
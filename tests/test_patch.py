@@ -0,0 +1,152 @@
+import pytest
+
+from models import Portfolio, PortfolioUpdate, Project, ProjectUpdate, Service, ServiceUpdate
+from patch import PatchError, json_patch_to_update, merge_patch_to_update
+
+PORTFOLIO = (Portfolio, PortfolioUpdate.model_fields)
+SERVICE = (Service, ServiceUpdate.model_fields)
+PROJECT = (Project, ProjectUpdate.model_fields)
+
+
+def merge(patch, target=PORTFOLIO):
+    return merge_patch_to_update(patch, *target)
+
+
+def json_patch(operations, target=PORTFOLIO):
+    return json_patch_to_update(operations, *target)
+
+
+# Merge patch
+
+def test_merge_sets_nested_leaves():
+    assert merge({"personal": {"tagline": "Hi"}, "about": {"bio": None}}) == {
+        "$set": {"personal.tagline": "Hi"},
+        "$unset": {"about.bio": ""},
+    }
+
+
+def test_merge_replaces_lists_and_validates_values():
+    update = merge({"about": {"experience": [{"role": "Lead", "company": "Acme", "period": "2024"}]}})
+    assert update == {"$set": {"about.experience": [{"role": "Lead", "company": "Acme", "period": "2024"}]}}
+
+
+def test_merge_unsets_optional_top_level_field():
+    assert merge({"color": None}, SERVICE) == {"$unset": {"color": ""}}
+
+
+@pytest.mark.parametrize("patch, target", [
+    ({"active": None}, SERVICE),
+    ({"active": None}, PROJECT),
+    ({"category": None}, PROJECT),
+    ({"personal": {"name": None}}, PORTFOLIO),
+])
+def test_merge_rejects_removing_non_nullable_fields(patch, target):
+    with pytest.raises(PatchError, match="cannot be removed"):
+        merge(patch, target)
+
+
+@pytest.mark.parametrize("patch, message", [
+    ([], "JSON object"),
+    ({"id": "x"}, "cannot be patched"),
+    ({"personal": {"nickname": "x"}}, "Unknown field"),
+    ({"personal": {"email": 42}}, "Invalid value"),
+    ({"about": {"bio": {"text": "x"}}}, "Invalid value"),
+])
+def test_merge_rejections(patch, message):
+    with pytest.raises(PatchError, match=message):
+        merge(patch)
+
+
+# JSON Patch
+
+def test_json_patch_replace_and_remove():
+    assert json_patch([
+        {"op": "replace", "path": "/personal/title", "value": "Designer"},
+        {"op": "remove", "path": "/about/bio"},
+    ]) == {"$set": {"personal.title": "Designer"}, "$unset": {"about.bio": ""}}
+
+
+def test_json_patch_appends_collapse_into_each():
+    assert json_patch([
+        {"op": "add", "path": "/about/skills/-", "value": "Blender"},
+    ]) == {"$push": {"about.skills": "Blender"}}
+    assert json_patch([
+        {"op": "add", "path": "/about/skills/-", "value": "Blender"},
+        {"op": "add", "path": "/about/skills/-", "value": "Figma"},
+    ]) == {"$push": {"about.skills": {"$each": ["Blender", "Figma"]}}}
+
+
+def test_json_patch_insert_at_index_uses_position():
+    assert json_patch([{"op": "add", "path": "/about/skills/0", "value": "Blender"}]) == {
+        "$push": {"about.skills": {"$each": ["Blender"], "$position": 0}}
+    }
+
+
+def test_json_patch_remove_by_value_collapses_into_in():
+    item = {"name": "Contact", "href": "#contact"}
+    assert json_patch([{"op": "remove", "path": "/navigation", "value": item}]) == {
+        "$pull": {"navigation": {"$in": [item]}}
+    }
+    assert json_patch([
+        {"op": "remove", "path": "/about/skills", "value": "Blender"},
+        {"op": "remove", "path": "/about/skills", "value": "Figma"},
+    ]) == {"$pull": {"about.skills": {"$in": ["Blender", "Figma"]}}}
+    assert json_patch([{"op": "remove", "path": "/about/skills", "value": "Blender"}]) == {
+        "$pull": {"about.skills": "Blender"}
+    }
+
+
+def test_json_patch_unescapes_pointer_segments():
+    with pytest.raises(PatchError, match="Unknown field 'personal.a/b~c'"):
+        json_patch([{"op": "replace", "path": "/personal/a~1b~0c", "value": "x"}])
+
+
+@pytest.mark.parametrize("operations, message", [
+    ({}, "array of operations"),
+    (["x"], "must be objects"),
+    ([{"op": "move", "path": "/personal/title"}], "Unsupported"),
+    ([{"op": "replace", "path": "personal/title", "value": "x"}], "Invalid JSON pointer"),
+    ([{"op": "replace", "path": "/personal/title"}], "requires a value"),
+    ([{"op": "replace", "path": "/about/skills/-", "value": "x"}], "end of an array"),
+    ([{"op": "replace", "path": "/about/skills/x", "value": "x"}], "Invalid array index"),
+    ([{"op": "remove", "path": "/about/skills/0"}], "not supported"),
+    ([{"op": "remove", "path": "/personal/title", "value": "x"}], "requires an array"),
+    ([{"op": "remove", "path": "/personal/email"}], "cannot be removed"),
+    ([{"op": "replace", "path": "/personal/title/x", "value": "x"}], "does not address"),
+    ([{"op": "replace", "path": "/", "value": "x"}], "cannot be patched"),
+])
+def test_json_patch_rejections(operations, message):
+    with pytest.raises(PatchError, match=message):
+        json_patch(operations)
+
+
+def test_json_patch_rejects_removing_defaulted_fields():
+    with pytest.raises(PatchError, match="cannot be removed"):
+        json_patch([{"op": "remove", "path": "/active"}], SERVICE)
+
+
+@pytest.mark.parametrize("operations", [
+    [
+        {"op": "replace", "path": "/about", "value": {"bio": "x"}},
+        {"op": "replace", "path": "/about/bio", "value": "y"},
+    ],
+    [
+        {"op": "replace", "path": "/about/bio", "value": "x"},
+        {"op": "remove", "path": "/about/bio"},
+    ],
+    [
+        {"op": "add", "path": "/about/skills/-", "value": "x"},
+        {"op": "remove", "path": "/about/skills", "value": "y"},
+    ],
+])
+def test_json_patch_rejects_conflicting_paths(operations):
+    with pytest.raises(PatchError, match="Conflicting"):
+        json_patch(operations)
+
+
+def test_json_patch_allows_one_positional_insert_per_array():
+    with pytest.raises(PatchError, match="one positional insert"):
+        json_patch([
+            {"op": "add", "path": "/about/skills/0", "value": "x"},
+            {"op": "add", "path": "/about/skills/-", "value": "y"},
+        ])
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import sqlite3
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+import payloads
+from payloads import PayloadRefresher, PayloadSnapshot, build_payloads, write_payload_snapshot
+from repository import write_snapshot
+
+
+def document(tenant, key, **fields):
+    return {"_id": ObjectId(), "tenant": tenant, "id": key, **fields}
+
+
+def body(response):
+    return json.loads(bytes(response.body))
+
+
+def test_build_payloads_groups_by_tenant():
+    projects = [document("a", "p1", title="One"), document("b", "p2"), document(None, "orphan")]
+    services = [document("a", "s1")]
+    portfolios = [document("b", "portfolio", name="B")]
+
+    built = build_payloads(portfolios, services, projects, single_tenant=False)
+
+    assert sorted(built) == ["a", "b"]
+    assert sorted(built["a"]) == ["project:p1", "projects", "services"]
+    assert sorted(built["b"]) == ["portfolio", "project:p2", "projects", "services"]
+    detail = json.loads(built["a"]["project:p1"])
+    assert detail == {"success": True, "data": {"id": str(projects[0]["_id"]), "title": "One"}}
+
+    single = build_payloads(portfolios, services, projects, single_tenant=True)
+    assert list(single) == [""]
+    assert len(json.loads(single[""]["projects"])["data"]) == 3
+
+
+def test_body_matches_sqlite_snapshot(tmp_path):
+    project = document("a", "p1", created_at=datetime(2024, 5, 1, 12, 30), tags=["x"])
+    write_snapshot(tmp_path / "snapshot.db", [], [], [project])
+    conn = sqlite3.connect(tmp_path / "snapshot.db")
+    (stored,) = conn.execute("SELECT body FROM documents").fetchone()
+    conn.close()
+
+    encoded = build_payloads([], [], [project], single_tenant=False)["a"]["project:p1"]
+    assert json.loads(encoded)["data"] == json.loads(stored)
+
+
+def test_snapshot_round_trip_and_swap(tmp_path):
+    path = tmp_path / "payloads.bin"
+    built = build_payloads([], [], [document("a", "p1", title="Old")], single_tenant=False)
+    assert write_payload_snapshot(path, {"a": (time.time(), built["a"])}, time.time()) == 1
+    snapshot = PayloadSnapshot(path)
+
+    response = snapshot.response("a", "project:p1")
+    assert response.headers["X-Payload-Version"] == "1"
+    assert body(response)["data"]["title"] == "Old"
+    assert snapshot.response("a", "project:missing") is None
+    assert snapshot.response("b", "projects") is None
+
+    built = build_payloads([], [], [document("a", "p1", title="New")], single_tenant=False)
+    assert write_payload_snapshot(path, {"a": (time.time(), built["a"])}, time.time()) == 2
+    response = snapshot.response("a", "project:p1")
+    assert response.headers["X-Payload-Version"] == "2"
+    assert body(response)["data"]["title"] == "New"
+    assert snapshot.stats()["hits"] == 2
+    assert snapshot.stats()["misses"] == 2
+
+
+def test_write_bypasses_only_until_tenant_is_reread(tmp_path):
+    path = tmp_path / "payloads.bin"
+    built = build_payloads([], [], [document("a", "p1"), document("b", "p2")], single_tenant=False)
+    before = time.time()
+    write_payload_snapshot(path, {tenant: (before, entries) for tenant, entries in built.items()}, before)
+    snapshot = PayloadSnapshot(path)
+
+    snapshot.mark_written("a")
+    assert snapshot.response("a", "projects") is None
+    assert snapshot.response("b", "projects") is not None
+
+    # A newer build that carried tenant "a" over from before the write
+    after = time.time() + 1
+    write_payload_snapshot(path, {"a": (before, built["a"]), "b": (after, built["b"])}, after)
+    assert snapshot.response("a", "projects") is None
+
+    write_payload_snapshot(path, {"a": (after, built["a"]), "b": (after, built["b"])}, after)
+    assert snapshot.response("a", "projects") is not None
+    assert snapshot.stats()["bypassed"] == 2
+
+
+def test_refresher_rebuilds_only_dirty_tenants(tmp_path, monkeypatch):
+    data = {"a": [document("a", "p1", title="A1")], "b": [document("b", "p2", title="B1")]}
+    reads = []
+
+    async def read_public_dataset(repository, tenants=None):
+        reads.append(tenants)
+        scoped = [d for tenant, docs in data.items() if tenants is None or tenant in tenants for d in docs]
+        return [], [], scoped
+
+    monkeypatch.setattr(payloads, "read_public_dataset", read_public_dataset)
+    path = tmp_path / "payloads.bin"
+    refresher = PayloadRefresher(path, single_tenant=False)
+    snapshot = PayloadSnapshot(path)
+
+    asyncio.run(refresher.refresh(None))
+    data["a"] = [document("a", "p1", title="A2")]
+    data["b"] = [document("b", "p2", title="B2")]
+    asyncio.run(refresher.refresh(None, ["a"]))
+
+    assert reads == [None, ["a"]]
+    assert body(snapshot.response("a", "project:p1"))["data"]["title"] == "A2"
+    # Tenant "b" was carried over, not re-read
+    assert body(snapshot.response("b", "project:p2"))["data"]["title"] == "B1"
+
+    data["a"] = []
+    asyncio.run(refresher.refresh(None, ["a"]))
+    assert snapshot.response("a", "project:p1") is None
+    assert refresher.stats()["builds"] == 3
+    assert refresher.stats()["full_builds"] == 1
+
+
+def test_single_tenant_refresher_always_rereads_everything(tmp_path, monkeypatch):
+    reads = []
+
+    async def read_public_dataset(repository, tenants=None):
+        reads.append(tenants)
+        return [], [], [document(None, "p1")]
+
+    monkeypatch.setattr(payloads, "read_public_dataset", read_public_dataset)
+    refresher = PayloadRefresher(tmp_path / "payloads.bin", single_tenant=True)
+    asyncio.run(refresher.refresh(None, [""]))
+
+    assert reads == [None]
+    assert PayloadSnapshot(tmp_path / "payloads.bin").response(None, "project:p1") is not None
@@ -0,0 +1,101 @@
+import asyncio
+import random
+
+import numpy as np
+
+from related import RelatedIndex, RelatedProjects
+from repository import SnapshotRepository, write_snapshot
+
+
+def project(key, category, client=None, year=None):
+    return {"id": key, "title": key.upper(), "category": category, "client": client, "year": year}
+
+
+PROJECTS = [
+    project("a", ["Branding", "Print"], "X", "2023"),
+    project("b", ["Branding"], "X", "2022"),
+    project("c", ["Web", "UI"], "Y", "2021"),
+    project("d", ["Web"], None, "2023"),
+    project("e", ["Print"], "Z", None),
+]
+
+
+def keyed(projects):
+    return [(p["id"], p) for p in projects]
+
+
+def ranked(index, key, limit=8):
+    return [(p["id"], p["score"]) for p in index.related(key, limit)]
+
+
+def test_ranking_weights_categories_client_and_year():
+    index = RelatedIndex()
+    index.refresh(keyed(PROJECTS))
+    # b: jaccard 1/2, same client, one year apart; e: jaccard 1/2 only
+    assert ranked(index, "a") == [
+        ("b", round(0.7 * 0.5 + 0.2 + 0.1 * np.exp(-1 / 3), 4)),
+        ("e", 0.35),
+        ("d", 0.1),
+        ("c", round(0.1 * np.exp(-2 / 3), 4)),
+    ]
+    assert ranked(index, "a", limit=1) == ranked(index, "a")[:1]
+    # Nothing in common with c or d at all
+    assert ranked(index, "e") == [("a", 0.35)]
+
+
+def test_unknown_project_returns_none():
+    index = RelatedIndex()
+    index.refresh(keyed(PROJECTS))
+    assert index.related("missing", 4) is None
+
+
+def test_single_project_has_no_related():
+    index = RelatedIndex()
+    index.refresh(keyed(PROJECTS[:1]))
+    assert index.related("a", 4) == []
+
+
+def random_project(rng, key):
+    categories = rng.sample(["Branding", "Print", "Web", "UI", "Motion"], rng.randint(0, 3))
+    return project(key, categories, rng.choice([None, "X", "Y", "Z"]), rng.choice([None, "2020", "2022", "2024"]))
+
+
+def test_incremental_refresh_matches_full_rebuild():
+    rng = random.Random(7)
+    projects = [random_project(rng, f"p{i}") for i in range(12)]
+    incremental = RelatedIndex()
+    incremental.refresh(keyed(projects))
+    for step in range(40):
+        action = rng.random()
+        if action < 0.4:
+            i = rng.randrange(len(projects))
+            projects[i] = dict(projects[i], year=rng.choice(["2020", "2021", "2024"]))
+        elif action < 0.6:
+            projects.append(random_project(rng, f"n{step}"))
+        elif action < 0.8 and len(projects) > 2:
+            projects.pop(rng.randrange(len(projects)))
+        else:
+            rng.shuffle(projects)
+        incremental.refresh(keyed(projects))
+        full = RelatedIndex()
+        full.refresh(keyed(projects))
+        assert incremental.ids == full.ids
+        np.testing.assert_allclose(incremental.scores, full.scores)
+        for key in full.ids:
+            assert ranked(incremental, key) == ranked(full, key)
+
+
+def test_related_projects_are_keyed_on_raw_id(tmp_path):
+    path = tmp_path / "snapshot.db"
+    documents = [dict(p, _id=f"object-{p['id']}", active=True, order=i) for i, p in enumerate(PROJECTS)]
+    write_snapshot(path, [], [], documents)
+    repository = SnapshotRepository(path)
+
+    async def scenario():
+        related = RelatedProjects(repository)
+        assert (await repository.get_project(None, "a"))["id"] == "object-a"
+        return await related.related(None, "a", 2), await related.related(None, "object-a", 2)
+    by_raw_id, by_object_id = asyncio.run(scenario())
+    # Payloads keep the converted id, as in the project list
+    assert [p["id"] for p in by_raw_id] == ["object-b", "object-e"]
+    assert by_object_id is None
@@ -0,0 +1,205 @@
+import asyncio
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from bson import ObjectId
+
+from cache import TenantCache
+from jobs import JobQueue
+from repository import (
+    CachedRepository, MongoRepository, SnapshotRepository, SnapshotUnavailableError,
+    pull_snapshot, write_snapshot,
+)
+
+
+def document(tenant, key, **fields):
+    return {"_id": ObjectId(), "tenant": tenant, "id": key, "active": True, **fields}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def titles(documents):
+    return [d["title"] for d in documents]
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = tmp_path / "snapshot.db"
+    write_snapshot(
+        path,
+        [document("a", None, name="A"), document("b", None, name="B")],
+        [document("a", "s1", title="A service")],
+        [document("a", "p1", title="A1"), document("b", "p1", title="B1"), document("a", "p2", title="A2")],
+    )
+    return path
+
+
+def test_snapshot_reads_are_scoped_to_the_tenant(snapshot_path):
+    repository = SnapshotRepository(snapshot_path)
+
+    assert run(repository.get_portfolio("a"))["name"] == "A"
+    assert titles(run(repository.list_projects("a"))) == ["A1", "A2"]
+    assert titles(run(repository.list_projects("b"))) == ["B1"]
+    assert run(repository.list_services("b")) == []
+    # The same raw id in two tenants resolves to each tenant's own project
+    assert run(repository.get_project("a", "p1"))["title"] == "A1"
+    assert run(repository.get_project("b", "p1"))["title"] == "B1"
+    assert run(repository.get_project("b", "p2")) is None
+    assert "tenant" not in run(repository.get_project("a", "p1"))
+    # Single-tenant mode is unscoped
+    assert titles(run(repository.list_projects(None))) == ["A1", "B1", "A2"]
+
+
+def test_partial_write_replaces_only_named_tenants(snapshot_path):
+    write_snapshot(snapshot_path, [], [], [document("a", "p3", title="A3")], tenants=["a"])
+    repository = SnapshotRepository(snapshot_path)
+
+    assert titles(run(repository.list_projects("a"))) == ["A3"]
+    assert run(repository.get_portfolio("a")) is None
+    assert titles(run(repository.list_projects("b"))) == ["B1"]
+    assert run(repository.get_portfolio("b"))["name"] == "B"
+
+
+def test_missing_snapshot_is_unavailable_until_written(tmp_path, snapshot_path):
+    repository = SnapshotRepository(tmp_path / "missing.db")
+    with pytest.raises(SnapshotUnavailableError):
+        run(repository.list_projects("a"))
+
+    repository = SnapshotRepository(snapshot_path)
+    assert titles(run(repository.list_projects("b"))) == ["B1"]
+    # A file removed after it was opened keeps being served
+    snapshot_path.unlink()
+    assert titles(run(repository.list_projects("b"))) == ["B1"]
+
+
+class FakeRepository:
+    read_only = False
+    has_change_log = False
+
+    def __init__(self):
+        self.projects = {"a": ["a1"], "b": ["b1"]}
+        self.loads = []
+
+    async def list_projects(self, tenant):
+        self.loads.append(tenant)
+        return list(self.projects[tenant])
+
+    async def create_project(self, tenant, document):
+        self.projects[tenant].append(document)
+        return document
+
+
+def test_cached_writes_invalidate_only_the_writing_tenant():
+    inner = FakeRepository()
+    repository = CachedRepository(inner, TenantCache(tenant_bytes=1000, total_bytes=10000, ttl=60))
+
+    async def scenario():
+        await repository.list_projects("a")
+        await repository.list_projects("b")
+        assert await repository.list_projects("a") == ["a1"]
+        await repository.create_project("a", "a2")
+        assert await repository.list_projects("a") == ["a1", "a2"]
+        assert await repository.list_projects("b") == ["b1"]
+    run(scenario())
+    assert inner.loads == ["a", "b", "a"]
+
+
+def test_cached_writes_queue_cache_warming():
+    inner = FakeRepository()
+    inner.get_portfolio = inner.list_services = inner.list_projects
+
+    async def scenario():
+        jobs = JobQueue()
+        jobs.start()
+        repository = CachedRepository(inner, TenantCache(tenant_bytes=1000, total_bytes=10000, ttl=60), jobs)
+        await repository.create_project("a", "a2")
+        await jobs.stop()
+        inner.loads.clear()
+        assert await repository.list_projects("a") == ["a1", "a2"]
+    run(scenario())
+    assert inner.loads == []
+
+
+def test_export_after_write_rereads_only_the_writing_tenant(mongo, tmp_path):
+    path = tmp_path / "export.db"
+
+    async def scenario():
+        jobs = JobQueue()
+        jobs.start()
+        repository = MongoRepository(snapshot_path=str(path), jobs=jobs)
+        await mongo.projects.insert_one(document("a", "p1", title="A1", order=1))
+        await mongo.projects.insert_one(document("b", "p1", title="B1", order=1))
+        await repository.startup()
+        await jobs._queue.join()
+        # Bypasses the repository, so nothing queues an export of tenant b
+        await mongo.projects.update_one({"tenant": "b"}, {"$set": {"title": "B2"}})
+        await repository.create_project("a", {"id": "p2", "title": "A2", "active": True, "order": 2})
+        await jobs.stop()
+
+    run(scenario())
+    snapshot = SnapshotRepository(path)
+    assert titles(run(snapshot.list_projects("a"))) == ["A1", "A2"]
+    assert titles(run(snapshot.list_projects("b"))) == ["B1"]
+
+
+class SnapshotHandler(BaseHTTPRequestHandler):
+    body = b""
+    etag = '"1"'
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def source(snapshot_path):
+    SnapshotHandler.body = snapshot_path.read_bytes()
+    SnapshotHandler.requests = []
+    server = HTTPServer(("127.0.0.1", 0), SnapshotHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/api/ops/snapshot"
+    server.shutdown()
+    server.server_close()
+
+
+def test_pull_downloads_then_revalidates(source, tmp_path):
+    path = tmp_path / "edge" / "snapshot.db"
+
+    etag = pull_snapshot(source, path, token="secret")
+    assert etag == '"1"'
+    assert titles(run(SnapshotRepository(path).list_projects("a"))) == ["A1", "A2"]
+    stamp = path.stat().st_mtime_ns
+
+    assert pull_snapshot(source, path, token="secret", etag=etag) == etag
+    assert path.stat().st_mtime_ns == stamp
+    assert [r.get("If-None-Match") for r in SnapshotHandler.requests] == [None, '"1"']
+    assert SnapshotHandler.requests[0]["Authorization"] == "Bearer secret"
+
+
+def test_pull_keeps_current_file_when_download_is_not_a_snapshot(source, snapshot_path, tmp_path):
+    path = tmp_path / "edge" / "snapshot.db"
+    path.parent.mkdir()
+    path.write_bytes(snapshot_path.read_bytes())
+    SnapshotHandler.body = b"<html>not a snapshot</html>"
+
+    with pytest.raises(sqlite3.DatabaseError):
+        pull_snapshot(source, path)
+    assert titles(run(SnapshotRepository(path).list_projects("b"))) == ["B1"]
+    assert [p.name for p in path.parent.iterdir()] == ["snapshot.db"]
@@ -0,0 +1,92 @@
+import pytest
+
+import tenancy
+
+
+@pytest.mark.parametrize("suffix", ["example.com", ".example.com"])
+@pytest.mark.parametrize("host, tenant", [
+    ("alex.example.com", "alex"),
+    ("Alex.Example.com:8000", "alex"),
+    ("a.b.example.com.", "a.b"),
+    ("example.com", None),
+    ("badexample.com", "badexample.com"),
+    ("alex.example.org", "alex.example.org"),
+    ("", None),
+])
+def test_tenant_from_host_strips_suffix_on_label_boundary(monkeypatch, suffix, host, tenant):
+    monkeypatch.setattr(tenancy, "TENANT_HOST_SUFFIX", suffix.strip("."))
+    assert tenancy.tenant_from_host(host) == tenant
+
+
+def test_tenant_from_host_without_suffix(monkeypatch):
+    monkeypatch.setattr(tenancy, "TENANT_HOST_SUFFIX", "")
+    assert tenancy.tenant_from_host("alex.example.com") == "alex.example.com"
+
+
+def test_split_tenant_path():
+    assert tenancy.split_tenant_path("/t/alex/api/projects") == ("alex", "/api/projects")
+
+
+def new_project(title):
+    return {"title": title, "description": "d", "category": ["Branding"]}
+
+
+def raw_id(api, mongo, tenant, title):
+    """The ``id`` the detail routes look up (responses carry the ObjectId instead)"""
+    return api.portal.call(mongo.projects.find_one, {"tenant": tenant, "title": title})["id"]
+
+
+@pytest.fixture
+def path_mode(monkeypatch):
+    monkeypatch.setattr(tenancy, "TENANT_MODE", "path")
+
+
+def test_path_tenants_never_see_each_others_data(path_mode, api, mongo):
+    for tenant in ("alice", "bob"):
+        api.portal.call(mongo.portfolio.insert_one, {
+            "tenant": tenant, "personal": {"name": tenant, "title": "t", "email": f"{tenant}@x"},
+        })
+        assert api.post(f"/t/{tenant}/api/projects", json=new_project(f"{tenant} project")).status_code == 200
+        assert api.post(f"/t/{tenant}/api/services",
+                        json={"title": f"{tenant} service", "description": "d"}).status_code == 200
+    alice_project = raw_id(api, mongo, "alice", "alice project")
+
+    assert api.get("/t/alice/api/portfolio").json()["data"]["personal"]["name"] == "alice"
+    assert [p["title"] for p in api.get("/t/bob/api/projects").json()["data"]] == ["bob project"]
+    assert [s["title"] for s in api.get("/t/bob/api/services").json()["data"]] == ["bob service"]
+    assert api.get(f"/t/alice/api/projects/{alice_project}").json()["data"]["title"] == "alice project"
+    assert "tenant" not in api.get(f"/t/alice/api/projects/{alice_project}").json()["data"]
+
+    # Another tenant can neither read nor change alice's project by its id
+    assert api.get(f"/t/bob/api/projects/{alice_project}").status_code == 404
+    assert api.put(f"/t/bob/api/projects/{alice_project}", json={"title": "taken"}).status_code == 404
+    assert api.patch(f"/t/bob/api/projects/{alice_project}", json={"title": "taken"}).status_code == 404
+    assert api.delete(f"/t/bob/api/projects/{alice_project}").status_code == 404
+    assert api.get(f"/t/alice/api/projects/{alice_project}").json()["data"]["title"] == "alice project"
+
+    bob_changes = api.get("/t/bob/api/changes").json()["data"]["changes"]
+    assert [(c["collection"], c["op"]) for c in bob_changes] == [("projects", "create"), ("services", "create")]
+
+
+def test_path_mode_rejects_missing_and_invalid_tenants(path_mode, api):
+    response = api.get("/api/projects")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Tenant could not be resolved"
+
+    response = api.get("/t/not_a_host/api/projects")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid tenant"
+    assert api.get("/t/Alice/api/projects").status_code == 200
+
+
+def test_host_mode_resolves_tenant_from_host(monkeypatch, api, mongo):
+    monkeypatch.setattr(tenancy, "TENANT_MODE", "host")
+    monkeypatch.setattr(tenancy, "TENANT_HOST_SUFFIX", "sites.example.com")
+    api.post("/api/projects", json=new_project("alice project"), headers={"Host": "alice.sites.example.com"})
+    api.post("/api/projects", json=new_project("bob project"), headers={"Host": "bob.sites.example.com"})
+
+    response = api.get("/api/projects", headers={"Host": "alice.sites.example.com:8000"})
+    assert [p["title"] for p in response.json()["data"]] == ["alice project"]
+    assert api.portal.call(mongo.projects.count_documents, {"tenant": "bob"}) == 1
+    assert api.get("/api/projects", headers={"Host": "sites.example.com"}).status_code == 400
+    assert api.get("/api/projects", headers={"Host": "bad_host.sites.example.com"}).status_code == 400
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+
+import pytest
+
+import tracing
+
+
+class FakeDatabase:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.explained = []
+
+    async def command(self, command):
+        self.explained.append(command["explain"])
+        await asyncio.sleep(self.delay)
+        return {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}
+
+
+@pytest.fixture(autouse=True)
+def slow_queries(monkeypatch):
+    monkeypatch.setattr(tracing, "SLOW_QUERY_MS", 0.001)
+    monkeypatch.setattr(tracing, "_last_explained", {})
+    monkeypatch.setattr(tracing, "_suppressed", {})
+
+
+def find(collection, **query):
+    return {"find": collection, "filter": query}
+
+
+async def slow(db, command):
+    with tracing.query_span(db, command):
+        await asyncio.sleep(0.002)
+
+
+async def settle():
+    await asyncio.gather(*tracing._explain_tasks)
+
+
+def test_each_query_shape_is_explained_once_per_interval(caplog):
+    async def scenario():
+        db = FakeDatabase()
+        await slow(db, find("projects", tenant="a", active=True))
+        await settle()
+        # Same shape with other values, then a new shape
+        await slow(db, find("projects", tenant="b", active=True))
+        await slow(db, find("projects", tenant="c", active=True))
+        await slow(db, find("projects", id="x"))
+        await settle()
+        return db.explained
+    with caplog.at_level(logging.WARNING):
+        explained = asyncio.run(scenario())
+    assert explained == [find("projects", tenant="a", active=True), find("projects", id="x")]
+    assert tracing._suppressed == {("find", "projects", ("active", "tenant")): 2}
+
+
+def test_shape_is_explained_again_after_interval_with_repeat_count(monkeypatch, caplog):
+    monkeypatch.setattr(tracing, "SLOW_QUERY_EXPLAIN_INTERVAL", 0)
+
+    async def scenario():
+        db = FakeDatabase()
+        tracing._suppressed[("find", "services", ("active",))] = 3
+        await slow(db, find("services", active=True))
+        await settle()
+        return db.explained
+    with caplog.at_level(logging.WARNING):
+        assert len(asyncio.run(scenario())) == 1
+    assert "+3 slow runs" in caplog.text
+
+
+def test_explains_in_flight_are_capped(monkeypatch):
+    monkeypatch.setattr(tracing, "SLOW_QUERY_MAX_EXPLAINS", 1)
+
+    async def scenario():
+        db = FakeDatabase(delay=0.05)
+        await slow(db, find("projects", id="x"))
+        await slow(db, find("services", id="y"))
+        await settle()
+        return db.explained
+    assert asyncio.run(scenario()) == [find("projects", id="x")]
+    assert tracing._suppressed == {("find", "services", ("id",)): 1}
+
+
+def test_query_shape():
+    assert tracing._query_shape(None) == ("insert",)
+    assert tracing._query_shape({"findAndModify": "projects", "query": {"id": 1, "tenant": "a"}}) == (
+        "findAndModify", "projects", ("id", "tenant")
+    )
+
+
+def test_change_log_and_export_queries_are_reported(mongo, monkeypatch):
+    from repository import MongoRepository, read_public_dataset
+
+    reported = []
+    monkeypatch.setattr(tracing, "_report_slow_query", lambda db, command, elapsed_ms: reported.append(
+        tracing._query_shape(command)
+    ))
+
+    async def scenario():
+        repository = MongoRepository()
+        await repository.create_project("a", {"id": "p1", "title": "P", "active": True})
+        reported.clear()
+        await repository.update_project("a", "p1", {"$set": {"title": "Q"}})
+        await repository.list_changes("a", 0, 10)
+        await read_public_dataset(repository, ["a"])
+    asyncio.run(scenario())
+
+    assert reported == [
+        ("findAndModify", "projects", ("id", "tenant")),
+        ("findAndModify", "counters", ("_id",)),
+        ("insert",),
+        ("find", "counters", ("_id",)),
+        ("find", "changes", ("tenant",)),
+        ("find", "changes", ("seq", "tenant")),
+        ("find", "portfolio", ("tenant",)),
+        ("find", "services", ("active", "tenant")),
+        ("find", "projects", ("active", "tenant")),
+    ]
+
+
+@pytest.mark.parametrize("mode, token, sent, traced, cross_origin", [
+    ("header", None, "1", False, False),
+    ("header", "secret", "1", False, False),
+    ("header", "secret", "secret", True, True),
+    ("all", "secret", None, True, False),
+    ("off", "secret", "secret", False, False),
+])
+def test_tracing_needs_the_trace_token(monkeypatch, api, mode, token, sent, traced, cross_origin):
+    monkeypatch.setattr(tracing, "TRACE_REQUESTS", mode)
+    monkeypatch.setattr(tracing, "TRACE_TOKEN", token)
+    response = api.get("/api/projects", headers={"X-Trace": sent} if sent else {})
+
+    assert response.status_code == 200
+    assert ("server-timing" in response.headers) is traced
+    assert ("timing-allow-origin" in response.headers) is cross_origin
+
+
+def timings(response):
+    """``Server-Timing`` as {name: (ms, calls)}"""
+    phases = {}
+    for metric in response.headers["server-timing"].split(", "):
+        name, dur, *desc = metric.split(";")
+        calls = int(desc[0].split('"')[1].split()[0]) if desc else 1
+        phases[name] = (float(dur.removeprefix("dur=")), calls)
+    return phases
+
+
+@pytest.fixture
+def traced(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_REQUESTS", "header")
+    monkeypatch.setattr(tracing, "TRACE_TOKEN", "secret")
+    return {"X-Trace": "secret"}
+
+
+def test_server_timing_lists_request_phases(api, mongo, traced):
+    created = api.post("/api/projects", json={"title": "P", "description": "d", "category": []}, headers=traced)
+    phases = timings(created)
+    assert list(phases) == ["db", "changelog", "convert", "handler", "serialize", "total"]
+    # Counter increment and log insert
+    assert phases["changelog"][1] == 2
+    assert phases["handler"][0] >= phases["db"][0] + phases["changelog"][0]
+    assert phases["total"][0] >= phases["handler"][0] + phases["serialize"][0]
+
+    # A cache miss reads Mongo; the repeat is served from the cache
+    api.portal.call(mongo.projects.insert_one, {"id": "cold", "title": "C", "active": True})
+    assert list(timings(api.get("/api/projects/cold", headers=traced))) == [
+        "db", "convert", "handler", "serialize", "total"
+    ]
+    assert list(timings(api.get("/api/projects/cold", headers=traced))) == ["handler", "serialize", "total"]
+
+
+@pytest.mark.parametrize("sent, kept", [
+    ("req-1.a_B", True),
+    ("x" * 64, True),
+    ("x" * 65, False),
+    ("bad id", False),
+    ("", False),
+])
+def test_request_id_is_echoed_only_when_safe(api, sent, kept):
+    response = api.get("/api/services", headers={"X-Request-ID": sent})
+    if kept:
+        assert response.headers["x-request-id"] == sent
+    else:
+        assert len(response.headers["x-request-id"]) == 32
+        assert response.headers["x-request-id"] != sent
+
+
+def test_request_ids_differ_between_requests(api):
+    first, second = (api.get("/api/services").headers["x-request-id"] for _ in range(2))
+    assert first != second
+
+
+def test_logs_are_tagged_with_the_request_id(monkeypatch, api, caplog):
+    import server
+
+    async def failing(tenant):
+        raise RuntimeError("database down")
+    monkeypatch.setattr(server.repository, "list_services", failing)
+    caplog.handler.addFilter(tracing.RequestIdFilter())
+
+    with caplog.at_level(logging.ERROR):
+        assert api.get("/api/services", headers={"X-Request-ID": "trace-me"}).status_code == 500
+    assert [(r.request_id, r.getMessage()) for r in caplog.records] == [
+        ("trace-me", "Error fetching services: database down")
+    ]
+
+
+def test_slow_query_log_keeps_the_request_id(caplog):
+    caplog.handler.addFilter(tracing.RequestIdFilter())
+
+    async def scenario():
+        tracing.request_id_var.set("req-7")
+        await slow(FakeDatabase(), find("projects", id="x"))
+        tracing.request_id_var.set("-")
+        await settle()
+    with caplog.at_level(logging.WARNING):
+        asyncio.run(scenario())
+    assert [r.request_id for r in caplog.records] == ["req-7"]